@@ -0,0 +1,316 @@
+"""Офлайн-бенчмарк бота
+
+Поднимает локальные заглушки Users (8080), Spaces (8081) и Verify (8082) сервисов и
+Telegram Bot API (8083), собирает настоящий Dispatcher из bot.build_dispatcher и
+прогоняет через него синтетические апдейты. Для каждого сценария печатает updates/s
+и p50/p95/p99 задержки обработки апдейта.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --scenarios menu checkin --users 500 --backend-latency 0.02 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import random
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List
+
+from benchmarks.stubs import (ADMIN_TG_ID, FakeBotApi, Fault, SpacesState, VerifyState, booking_dates, spaces_app,
+                              start_app, users_app, verify_app)
+
+SCENARIOS = ("menu", "booking", "checkin", "checkin_token", "mailing")
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    error_types: Dict[str, int] = field(default_factory=dict)
+    elapsed: float = 0.0
+    notes: str = ""
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+    def row(self) -> str:
+        rate = len(self.latencies) / self.elapsed if self.elapsed else 0.0
+        return (f"{self.name:<10} {len(self.latencies):>8} {self.errors:>7} {rate:>10.1f} "
+                f"{self.percentile(0.50) * 1000:>9.1f} {self.percentile(0.95) * 1000:>9.1f} "
+                f"{self.percentile(0.99) * 1000:>9.1f}  {self.notes} {self._error_summary()}".rstrip())
+
+    def _error_summary(self) -> str:
+        return " ".join(f"err[{name}]={count}" for name, count in sorted(self.error_types.items()))
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._update_id = 0
+        self._message_id = 0
+
+    def _ids(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": "ru"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        update_id, message_id = self._ids()
+        entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith("/") else None
+        return {"update_id": update_id,
+                "message": {"message_id": message_id, "date": int(time.time()), "text": text,
+                            "entities": entities, "from": self._user(user_id),
+                            "chat": {"id": user_id, "type": "private"}}}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        update_id, message_id = self._ids()
+        return {"update_id": update_id,
+                "callback_query": {"id": str(update_id), "from": self._user(user_id), "chat_instance": "bench",
+                                   "data": data,
+                                   "message": {"message_id": message_id, "date": int(time.time()), "text": "menu",
+                                               "chat": {"id": user_id, "type": "private"}}}}
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.updates = UpdateFactory()
+        self.fake_api = FakeBotApi(Fault(latency=args.bot_latency))
+        self.spaces = SpacesState(coworkings=args.coworkings)
+        self.verify = VerifyState()
+        self.runners = []
+
+    async def start(self) -> None:
+        args = self.args
+        fault = Fault(latency=args.backend_latency, jitter=args.backend_jitter, error_rate=args.error_rate)
+        self.runners = [await start_app(users_app(args.users, fault), args.host, args.users_port),
+                        await start_app(spaces_app(self.spaces, fault), args.host, args.spaces_port),
+                        await start_app(verify_app(self.verify, fault), args.host, args.verify_port),
+                        await start_app(self.fake_api.app(), args.host, args.bot_api_port)]
+
+        # Модули бота импортируются после настройки окружения: конфиг и база читают его при импорте
+        self.bot_module = importlib.import_module("bot")
+        from aiogram import Bot
+        from aiogram.client.default import DefaultBotProperties
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        from aiogram.enums import ParseMode
+        from aiogram.types import Update
+        from src.backend.users_controller import BackendUsersController
+        from src.database.database import async_session_maker
+        from src.database.fsm_storage import SQLiteStorage
+
+        self.Update = Update
+        config = self.bot_module.load_conf()
+        self.pool_enabled = config.updates.pool_enabled
+        self.storage = SQLiteStorage(session_maker=async_session_maker, ttl=config.fsm.state_ttl,
+                                     cache_size=config.fsm.cache_size, flush_interval=config.fsm.flush_interval)
+        session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://{args.host}:{args.bot_api_port}"))
+        self.bot = Bot(token=config.tgbot.token, session=session,
+                       default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        self.bot_module.setup_send_scheduler(self.bot, config)
+        self.dp = self.bot_module.build_dispatcher(config, self.storage)
+
+        await self.bot_module.create_tables()
+        await self.bot_module.start_backend_sessions(config)
+        # Как в работающем боте после первой синхронизации: роли читаются из локального зеркала
+        await BackendUsersController.sync_users_mirror()
+
+    async def stop(self) -> None:
+        from src.services.broadcast import background_tasks
+        if background_tasks:
+            await asyncio.wait(set(background_tasks), timeout=30)
+        await self.storage.close()
+        await self.bot_module.close_backend_sessions()
+        await self.bot.session.close()
+        for runner in self.runners:
+            await runner.cleanup()
+
+    async def feed(self, result: ScenarioResult, raw_update: dict) -> None:
+        update = self.Update.model_validate(raw_update, context={"bot": self.bot})
+        start = time.perf_counter()
+        try:
+            # С пулом воркеров feed_update возвращается сразу после постановки в очередь,
+            # задержка считается до конца обработки
+            processed = asyncio.get_running_loop().create_future()
+            await self.dp.feed_update(self.bot, update, update_processed=processed)
+            if self.pool_enabled:
+                await processed
+        except Exception as e:
+            result.errors += 1
+            name = getattr(e, "status", None) or type(e).__name__
+            result.error_types[str(name)] = result.error_types.get(str(name), 0) + 1
+        finally:
+            result.latencies.append(time.perf_counter() - start)
+
+    async def run_users(self, result: ScenarioResult, user_ids: List[int],
+                        journey: Callable[[ScenarioResult, int], Awaitable[None]]) -> None:
+        start = time.perf_counter()
+        await asyncio.gather(*(journey(result, user_id) for user_id in user_ids))
+        result.elapsed = time.perf_counter() - start
+
+    def students(self) -> List[int]:
+        return list(range(1, self.args.users + 1))
+
+    async def scenario_menu(self) -> ScenarioResult:
+        """Навигация по меню: /start и проход по разделам FAQ, ссылок и отметки"""
+        result = ScenarioResult("menu")
+        steps = ["FAQ", "faq:contacts", "faq2:admin_contacts", "menu", "FAQ", "faq:stipend", "faq2:stipend_types",
+                 "menu", "nvk_links", "menu", "check_in", "menu"]
+
+        async def journey(result: ScenarioResult, user_id: int) -> None:
+            await self.feed(result, self.updates.message(user_id, "/start"))
+            for data in steps:
+                await self.feed(result, self.updates.callback(user_id, data))
+
+        await self.run_users(result, self.students(), journey)
+        return result
+
+    async def scenario_booking(self) -> ScenarioResult:
+        """Бронирование коворкинга: список, коворкинг, дата, время"""
+        result = ScenarioResult("booking")
+        dates = booking_dates()
+        grid = self.spaces.grid()
+
+        async def journey(result: ScenarioResult, user_id: int) -> None:
+            coworking_id = f"cw{random.randint(1, self.args.coworkings)}"
+            for data in ("coworking", f"cowo:{coworking_id}",
+                         f"date:{random.choice(dates).isoformat()}",
+                         f"time:{random.choice(grid).replace(':', '.')}"):
+                await self.feed(result, self.updates.callback(user_id, data))
+
+        await self.run_users(result, self.students(), journey)
+        booked = sum(len(slots) for slots in self.spaces.booked.values())
+        result.notes = f"booked={booked}"
+        return result
+
+    async def scenario_checkin(self) -> ScenarioResult:
+        """Всплеск QR-отметок: все студенты одновременно сканируют один код лекции"""
+        from src.services.check_in import check_in_pipeline
+        result = ScenarioResult("checkin")
+        edits_before = self.fake_api.calls.get("editmessagetext", 0)
+        start = time.perf_counter()
+        for _ in range(self.args.bursts):
+            lecture_uuid = uuid.uuid4().hex
+            await asyncio.gather(*(self.feed(result, self.updates.message(user_id, f"/start {lecture_uuid}"))
+                                   for user_id in self.students()))
+            # Результаты приходят правкой сообщения "проверяем…" после обработки очереди
+            await check_in_pipeline.join()
+        result.elapsed = time.perf_counter() - start
+        edits = self.fake_api.calls.get("editmessagetext", 0) - edits_before
+        result.notes = f"results={edits} done in {result.elapsed:.2f}s"
+        return result
+
+    async def scenario_checkin_token(self) -> ScenarioResult:
+        """Всплеск отметок по подписанным токенам: проверка локальная, отчет в Verify уходит пачками"""
+        import secrets
+        from src.services.check_in import check_in_reporter
+        from src.services.check_in_tokens import check_in_tokens
+        result = ScenarioResult("ci_token")
+        reported_before = self.verify.reported
+        start = time.perf_counter()
+        for _ in range(self.args.bursts):
+            token = check_in_tokens.issue(session_id=secrets.randbits(32), issuer_id=ADMIN_TG_ID)
+            await asyncio.gather(*(self.feed(result, self.updates.message(user_id, f"/start {token}"))
+                                   for user_id in self.students()))
+        result.elapsed = time.perf_counter() - start
+        await check_in_reporter.flush()
+        result.notes = f"reported={self.verify.reported - reported_before} batches={self.verify.batches}"
+        return result
+
+    async def scenario_mailing(self) -> ScenarioResult:
+        """Массовая рассылка: апдейты администратора и доставка всем пользователям из зеркала"""
+        from src.services.broadcast import background_tasks
+        result = ScenarioResult("mailing")
+        sent_before = self.fake_api.calls.get("copymessage", 0)
+        start = time.perf_counter()
+        await self.feed(result, self.updates.callback(ADMIN_TG_ID, "mailing"))
+        await self.feed(result, self.updates.message(ADMIN_TG_ID, "Бенчмарк: объявление для всех"))
+        if background_tasks:
+            await asyncio.wait(set(background_tasks))
+        result.elapsed = time.perf_counter() - start
+        sent = self.fake_api.calls.get("copymessage", 0) - sent_before
+        result.notes = f"delivered={sent} in {result.elapsed:.1f}s ({sent / result.elapsed:.1f} msg/s)"
+        return result
+
+    async def run(self) -> List[ScenarioResult]:
+        results = []
+        for name in self.args.scenarios:
+            scenario: Callable[[], Awaitable[ScenarioResult]] = getattr(self, f"scenario_{name}")
+            results.append(await scenario())
+        return results
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    base = f"http://{args.host}"
+    database_dir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.environ.update({
+        "BOT_TOKEN": "123456789:BENCHMARKbenchmarkBENCHMARKbenchmark",
+        "USERS_API_URL": f"{base}:{args.users_port}/api",
+        "SPACES_API_URL": f"{base}:{args.spaces_port}/api",
+        "VERIFY_API_URL": f"{base}:{args.verify_port}/api",
+        # Заглушка реализует предлагаемый эндпоинт приема отметок (см. VerifyApiController.report_check_ins)
+        "CHECK_IN_REPORT_PATH": "/check-ins/",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(database_dir, 'bench.db')}",
+    })
+    if not args.throttling:
+        # Синтетические пользователи кликают быстрее живых, троттлинг исказил бы задержки
+        os.environ["THROTTLING_BURST"] = "1000000"
+    if not args.outbound_limits:
+        # Заглушка Bot API не ограничивает частоту, лимиты Telegram измеряли бы сами себя
+        os.environ.update({"OUTBOUND_GLOBAL_RATE": "1000000", "OUTBOUND_CHAT_RATE": "1000000",
+                           "OUTBOUND_GROUP_RATE": "1000000"})
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк бота на заглушках сервисов и Bot API")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--users", type=int, default=200, help="число виртуальных студентов")
+    parser.add_argument("--coworkings", type=int, default=20)
+    parser.add_argument("--bursts", type=int, default=3, help="число всплесков QR-отметок")
+    parser.add_argument("--backend-latency", type=float, default=0.01, help="задержка сервисов, с")
+    parser.add_argument("--backend-jitter", type=float, default=0.005, help="случайная добавка к задержке, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500 от сервисов")
+    parser.add_argument("--bot-latency", type=float, default=0.005, help="задержка Bot API, с")
+    parser.add_argument("--throttling", action="store_true", help="не отключать троттлинг пользователей")
+    parser.add_argument("--outbound-limits", action="store_true", help="не отключать лимиты отправок в Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--users-port", type=int, default=8080)
+    parser.add_argument("--spaces-port", type=int, default=8081)
+    parser.add_argument("--verify-port", type=int, default=8082)
+    parser.add_argument("--bot-api-port", type=int, default=8083)
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    configure_environment(args)
+    bench = Bench(args)
+    await bench.start()
+    try:
+        results = await bench.run()
+    finally:
+        await bench.stop()
+
+    print(f"{'scenario':<10} {'updates':>8} {'errors':>7} {'updates/s':>10} "
+          f"{'p50, ms':>9} {'p95, ms':>9} {'p99, ms':>9}")
+    for result in results:
+        print(result.row())
+    calls: Dict[str, int] = bench.fake_api.calls
+    print("Bot API calls:", ", ".join(f"{method}={count}" for method, count in sorted(calls.items())))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
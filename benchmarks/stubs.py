@@ -0,0 +1,215 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from aiohttp import web
+
+ADMIN_TG_ID = 1_000_000
+
+
+@dataclass
+class Fault:
+    """Задержка и внедрение ошибок для заглушки сервиса"""
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+    async def apply(self) -> Optional[web.Response]:
+        delay = self.latency + random.uniform(0, self.jitter) if self.jitter else self.latency
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            return web.json_response({"status": "error", "message": "injected"}, status=500)
+        return None
+
+
+def fault_middleware(fault: Fault):
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        response = await fault.apply()
+        if response is not None:
+            return response
+        return await handler(request)
+    return middleware
+
+
+def users_app(students: int, fault: Fault) -> web.Application:
+    """Users Service: студенты с tgID 1..students и один администратор"""
+    users: Dict[str, dict] = {str(tg_id): {"tgID": str(tg_id), "role": "student", "name": f"student{tg_id}",
+                                           "language": "ru"}
+                              for tg_id in range(1, students + 1)}
+    users[str(ADMIN_TG_ID)] = {"tgID": str(ADMIN_TG_ID), "role": "admin", "name": "admin", "language": "ru"}
+
+    async def ping(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def list_users(request: web.Request) -> web.Response:
+        role = request.query.get("role")
+        return web.json_response([user for user in users.values() if role is None or user["role"] == role])
+
+    async def create_user(request: web.Request) -> web.Response:
+        body = await request.json()
+        users.setdefault(str(body["tgID"]), {"tgID": str(body["tgID"]), "role": "student", "name": "",
+                                             "language": body.get("language", "ru")})
+        return web.json_response({"status": "ok"})
+
+    async def get_user(request: web.Request) -> web.Response:
+        user = users.get(request.match_info["tg_id"])
+        if user is None:
+            return web.json_response({"status": "error", "message": "not found"}, status=404)
+        return web.json_response(user)
+
+    app = web.Application(middlewares=[fault_middleware(fault)])
+    app.router.add_get("/api/ping", ping)
+    app.router.add_get("/api/users/", list_users)
+    app.router.add_post("/api/users/", create_user)
+    app.router.add_get("/api/users/{tg_id}", get_user)
+    return app
+
+
+@dataclass
+class SpacesState:
+    coworkings: int
+    open_hour: int = 9
+    close_hour: int = 21
+    booked: Dict[str, Set[str]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        for index in range(1, self.coworkings + 1):
+            self.booked[f"cw{index}"] = set()
+
+    def grid(self) -> List[str]:
+        return [f"{hour:02d}:00" for hour in range(self.open_hour, self.close_hour)]
+
+
+def spaces_app(state: SpacesState, fault: Fault) -> web.Application:
+    """Spaces Service: коворкинги cw1..cwN с почасовой сеткой и аудитории"""
+
+    async def ping(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def rooms(request: web.Request) -> web.Response:
+        return web.json_response([{"id": f"room{index}", "is_booked": False, "booked_by": ""}
+                                  for index in range(1, 11)])
+
+    async def coworkings(request: web.Request) -> web.Response:
+        return web.json_response([{"id": coworking_id, "booked_time": sorted(booked)}
+                                  for coworking_id, booked in state.booked.items()])
+
+    async def available_time(request: web.Request) -> web.Response:
+        coworking_id = request.match_info["coworking_id"]
+        if coworking_id not in state.booked:
+            return web.json_response({"status": "error"}, status=404)
+        day = request.query["date"]
+        booked = state.booked[coworking_id]
+        return web.json_response({"id": coworking_id,
+                                  "available_times": [slot for slot in state.grid()
+                                                      if f"{day} {slot}" not in booked]})
+
+    async def book(request: web.Request) -> web.Response:
+        coworking_id = request.match_info["coworking_id"]
+        body = await request.json()
+        booked = state.booked.get(coworking_id)
+        if booked is None:
+            return web.json_response({"status": "error"}, status=404)
+        if body["time"] in booked:
+            return web.json_response({"status": "error", "message": "already booked"}, status=409)
+        booked.add(body["time"])
+        return web.json_response({"time": body["time"]})
+
+    app = web.Application(middlewares=[fault_middleware(fault)])
+    app.router.add_get("/api/ping", ping)
+    app.router.add_get("/api/rooms/", rooms)
+    app.router.add_get("/api/coworkings/", coworkings)
+    app.router.add_get("/api/coworkings/{coworking_id}", available_time)
+    app.router.add_post("/api/coworkings/{coworking_id}", book)
+    return app
+
+
+@dataclass
+class VerifyState:
+    reported: int = 0
+    batches: int = 0
+
+
+def verify_app(state: VerifyState, fault: Fault, valid_rate: float = 0.95) -> web.Application:
+    """Verify Service: случайная доля UUID считается невалидной, отметки по токенам принимаются пачками"""
+
+    async def verify(request: web.Request) -> web.Response:
+        return web.json_response({"uuid": request.match_info["uuid"], "valid": random.random() < valid_rate})
+
+    async def report_check_ins(request: web.Request) -> web.Response:
+        body = await request.json()
+        state.reported += len(body["check_ins"])
+        state.batches += 1
+        return web.json_response({"status": "ok"})
+
+    app = web.Application(middlewares=[fault_middleware(fault)])
+    app.router.add_post("/api/verify/{uuid}", verify)
+    app.router.add_post("/api/check-ins/", report_check_ins)
+    return app
+
+
+class FakeBotApi:
+    """Заглушка Telegram Bot API для TelegramAPIServer.from_base(...)
+
+    Отвечает правдоподобными объектами на методы, которые вызывает бот, и считает вызовы.
+    """
+
+    MESSAGE_METHODS = {"sendmessage", "editmessagetext", "editmessagereplymarkup", "sendphoto", "editmessagemedia"}
+    PHOTO_METHODS = {"sendphoto", "editmessagemedia"}
+
+    def __init__(self, fault: Fault):
+        self.fault = fault
+        self.calls: Dict[str, int] = {}
+        self._message_id = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def _message(self, chat_id: int, text: str = "") -> dict:
+        self._message_id += 1
+        return {"message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = await request.post()
+        if await self.fault.apply() is not None:
+            # Ошибка Bot API - флуд-контроль, как при превышении лимитов Telegram
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": "Too Many Requests: retry after 1",
+                                      "parameters": {"retry_after": 1}}, status=429)
+
+        if method in self.MESSAGE_METHODS:
+            result = self._message(int(params.get("chat_id", 0)), str(params.get("text", "")))
+            if method in self.PHOTO_METHODS:
+                file_id = f"photo{result['message_id']}"
+                result["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 330, "height": 330}]
+        elif method == "copymessage":
+            self._message_id += 1
+            result = {"message_id": self._message_id}
+        elif method == "getme":
+            result = {"id": 42, "is_bot": True, "first_name": "BenchBot", "username": "bench_bot"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+async def start_app(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    return runner
+
+
+def booking_dates(days: int = 6) -> List[date]:
+    """Даты для бронирования: начиная с завтра, чтобы сетка сегодняшнего дня не была в прошлом"""
+    today = datetime.now().date()
+    return [today + timedelta(days=offset) for offset in range(1, days + 1)]
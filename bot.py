@@ -1,39 +1,192 @@
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from config import Config, load_conf
 import asyncio
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.base import BaseStorage
 
 from src.handlers import common_handlers, student_handlers, other_handlers, admin_handlers
 from src import handlers
-from src.middleware.middleware import ThrottlingMiddleware, DBMiddleware
+from src.middleware.middleware import ThrottlingMiddleware, DBMiddleware, RoleMiddleware
+from src.callbacks.dispatch import CallbackPrefixMiddleware
 from src.database.database import async_session_maker
 from src.database.database import engine, Base
 from src.database import models
+from src.database.fsm_storage import SQLiteStorage
+from src.backend.users_controller import BackendUsersController
+from src.backend.spaces_controller import SpacesApiController
+from src.backend.qr_controller import VerifyApiController
+from src.backend.slot_index import coworking_slots
+from src.services.broadcast import resume_mailings, spawn
+from src.services.users_sync import run_users_sync
+from src.services.registration import user_registrar
+from src.services.webhook import run_webhook
+from src.services.loop_watchdog import loop_watchdog
+from src.services.check_in import check_in_pipeline, check_in_reconciler, check_in_reporter, \
+    restore_check_in_state
+from src.services.check_in_tokens import check_in_sessions, check_in_tokens
+from src.services.qr_images import qr_renderer
+from src.services.send_scheduler import send_scheduler
+from src.services.update_pool import update_pool
+from src.services.metrics import MetricsMiddleware, check_in_queue_size, db_updates_total, db_updates_with_session, \
+    fsm_storage_size, outbound_waiting, start_metrics_server, throttling_dropped, update_queue_depth
 
 
-async def main():
-    storage = MemoryStorage()
+async def start_backend_sessions(config: Config):
+    backend = config.backend
+    BackendUsersController.set_base_url(backend.users_url)
+    SpacesApiController.set_base_url(backend.spaces_url)
+    VerifyApiController.set_base_url(backend.verify_url)
+    VerifyApiController.set_report_path(config.check_in.report_path)
 
-    config: Config = load_conf()
+    await BackendUsersController.start_session(pool_size=backend.pool_size, timeout=backend.users_timeout)
+    await SpacesApiController.start_session(pool_size=backend.pool_size, timeout=backend.spaces_timeout)
+    await VerifyApiController.start_session(pool_size=backend.pool_size, timeout=backend.verify_timeout)
 
-    bot = Bot(token=config.tgbot.token,
-              default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+
+async def close_backend_sessions():
+    await BackendUsersController.close_session()
+    await SpacesApiController.close_session()
+    await VerifyApiController.close_session()
+
+
+def setup_send_scheduler(bot: Bot, config: Config) -> None:
+    """Все запросы бота к Bot API идут через общий планировщик отправок"""
+    outbound = config.outbound
+    send_scheduler.configure(global_rate=outbound.global_rate, chat_rate=outbound.chat_rate,
+                             group_rate=outbound.group_rate, burst=outbound.burst,
+                             max_retries=outbound.max_retries, max_flood_wait=outbound.max_flood_wait)
+    bot.session.middleware(send_scheduler)
+    outbound_waiting.set_callback(lambda: len(send_scheduler))
+
+
+async def create_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+def build_dispatcher(config: Config, storage: BaseStorage) -> Dispatcher:
+    """Собрать диспетчер со всеми middleware и роутерами (используется и бенчмарками)"""
     dp = Dispatcher(storage=storage)
 
+    if config.updates.pool_enabled:
+        # Самым внешним из наших middleware: все остальное выполняется уже в воркере пула
+        update_pool.configure(workers=config.updates.workers, queue_size=config.updates.queue_size,
+                              shard_size=config.updates.shard_size, policy=config.updates.overload_policy,
+                              router=dp)
+        dp.update.outer_middleware(update_pool)
+        update_queue_depth.set_callback(lambda: len(update_pool))
+
+    # Первым outer middleware, чтобы время апдейта включало определение роли
+    metrics_middleware = MetricsMiddleware()
+    dp.update.outer_middleware(metrics_middleware)
+    fsm_storage_size.set_callback(lambda: len(storage))
+
+    # Роль определяется один раз на апдейт, роутеры по ролям только сверяют data['role']
+    dp.update.outer_middleware(RoleMiddleware())
+
+    # Троттлинг на уровне message/callback_query: здесь уже известен хендлер и его throttling_cost.
+    # DB middleware регистрируется после него, поэтому отброшенные апдейты до БД не доходят
+    throttling_middleware = ThrottlingMiddleware(burst=config.throttling.burst, rate=config.throttling.rate)
+    dp.message.middleware(throttling_middleware)
+    dp.callback_query.middleware(throttling_middleware)
+    throttling_dropped.set_callback(lambda: throttling_middleware.dropped)
     db_middleware = DBMiddleware(session_maker=async_session_maker)
-    dp.update.middleware(db_middleware)
+    dp.message.middleware(db_middleware)
+    dp.callback_query.middleware(db_middleware)
+    db_updates_total.set_callback(lambda: db_middleware.updates_total)
+    db_updates_with_session.set_callback(lambda: db_middleware.updates_with_db)
+    # Время хендлеров пишется после троттлинга, отброшенные апдейты в гистограмму не попадают
+    dp.message.middleware(metrics_middleware)
+    dp.callback_query.middleware(metrics_middleware)
 
-    throttling_middleware = ThrottlingMiddleware()
-    dp.update.middleware(throttling_middleware)
+    # Префикс callback_data разбирается один раз, дальше роутеры ищут хендлер по индексу
+    dp.callback_query.outer_middleware(CallbackPrefixMiddleware())
 
     dp.include_router(admin_handlers.router)
     dp.include_router(student_handlers.router)
     dp.include_router(common_handlers.router)
     dp.include_router(other_handlers.router)
 
-    await dp.start_polling(bot)
+    async def drain_queues() -> None:
+        # Принятые апдейты и отметки дорабатываются, пока хранилище FSM и сессия бота еще открыты
+        await update_pool.join(timeout=config.updates.drain_timeout)
+        await check_in_pipeline.join(timeout=config.updates.drain_timeout)
+
+    # fsm.close зарегистрирован в конструкторе Dispatcher, а обработчики shutdown идут по порядку:
+    # дренаж ставим первым, до закрытия хранилища (и до закрытия сессии бота после shutdown)
+    dp.shutdown.register(drain_queues)
+    dp.shutdown.handlers.insert(0, dp.shutdown.handlers.pop())
+
+    return dp
+
+
+async def main():
+    config: Config = load_conf()
+
+    storage = SQLiteStorage(session_maker=async_session_maker, ttl=config.fsm.state_ttl,
+                            cache_size=config.fsm.cache_size, flush_interval=config.fsm.flush_interval,
+                            sweep_interval=config.fsm.sweep_interval)
+
+    coworking_slots.configure(open_time=config.coworking.open_time,
+                              close_time=config.coworking.close_time,
+                              slot_minutes=config.coworking.slot_minutes)
+
+    check_in_pipeline.configure(workers=config.check_in.workers, queue_size=config.check_in.queue_size)
+    check_in_queue_size.set_callback(lambda: len(check_in_pipeline))
+    check_in_tokens.configure(secret=config.check_in.secret, rotation=config.check_in.token_rotation,
+                              replay_ttl=config.check_in.replay_ttl)
+    check_in_sessions.duration = config.check_in.session_duration
+    check_in_sessions.prerender = config.check_in.qr_prerender
+    qr_renderer.configure(workers=config.check_in.qr_workers)
+    qr_renderer.start()
+    check_in_reporter.configure(batch_size=config.check_in.report_batch,
+                                interval=config.check_in.report_interval)
+    check_in_reconciler.configure(batch_size=config.check_in.reconcile_batch,
+                                  interval=config.check_in.reconcile_interval)
+
+    bot = Bot(token=config.tgbot.token,
+              default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    setup_send_scheduler(bot, config)
+    dp = build_dispatcher(config, storage)
+
+    await create_tables()
+    await user_registrar.load_known()
+    await start_backend_sessions(config)
+    # Зеркало пользователей заполняется в фоне, до этого роли берутся из API
+    spawn(run_users_sync(config.backend.users_sync_interval))
+    # Рассылки, прерванные прошлым перезапуском, продолжаются с неотправленных получателей
+    await resume_mailings(bot)
+    # Отметки, сохраненные офлайн до перезапуска, сверяются с Verify Service в фоне
+    check_in_reconciler.start(bot)
+    # Отметки по токенам из outbox досылаются, повторные сканы после перезапуска отклоняются
+    await restore_check_in_state()
+    if config.watchdog.enabled:
+        loop_watchdog.configure(threshold=config.watchdog.threshold, interval=config.watchdog.interval,
+                                history=config.watchdog.history)
+        loop_watchdog.start()
+    metrics_runner = None
+    if config.metrics.enabled:
+        metrics_runner = await start_metrics_server(config.metrics.host, config.metrics.port)
+    try:
+        if config.webhook.enabled:
+            await run_webhook(dp, bot, config.webhook)
+        else:
+            # Polling - режим по умолчанию для разработки, вебхук мешает getUpdates
+            await bot.delete_webhook()
+            # С пулом воркеров апдейты не нужно оборачивать в задачи: очередь пула ограничена,
+            # и при политике block polling ждет места в ней, а не копит задачи
+            await dp.start_polling(bot, handle_as_tasks=not config.updates.pool_enabled)
+    finally:
+        # Очереди апдейтов и отметок уже дренированы в shutdown диспетчера (build_dispatcher)
+        await check_in_reporter.close()
+        await check_in_reconciler.close()
+        qr_renderer.close()
+        await storage.close()
+        await close_backend_sessions()
+        await loop_watchdog.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == '__main__':
     asyncio.run(main())
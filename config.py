@@ -1,5 +1,7 @@
 from dataclasses import dataclass
-from environs import Env
+from urllib.parse import urlsplit
+
+from environs import Env, EnvError
 
 
 @dataclass
@@ -7,13 +9,183 @@ class TgBot:
     token: str
 
 
+@dataclass
+class Backend:
+    users_url: str
+    spaces_url: str
+    verify_url: str
+    pool_size: int
+    users_timeout: float
+    spaces_timeout: float
+    verify_timeout: float
+    users_sync_interval: float
+
+
+@dataclass
+class Coworking:
+    open_time: str
+    close_time: str
+    slot_minutes: int
+
+
+@dataclass
+class Webhook:
+    enabled: bool
+    base_url: str
+    path: str
+    secret: str
+    host: str
+    port: int
+    drain_timeout: float
+
+
+@dataclass
+class Fsm:
+    state_ttl: float
+    cache_size: int
+    flush_interval: float
+    sweep_interval: float
+
+
+@dataclass
+class Throttling:
+    burst: float
+    rate: float
+
+
+@dataclass
+class Updates:
+    pool_enabled: bool
+    workers: int
+    queue_size: int
+    shard_size: int
+    overload_policy: str
+    drain_timeout: float
+
+
+@dataclass
+class Outbound:
+    global_rate: float
+    chat_rate: float
+    group_rate: float
+    burst: float
+    max_retries: int
+    max_flood_wait: float
+
+
+@dataclass
+class Metrics:
+    enabled: bool
+    host: str
+    port: int
+
+
+@dataclass
+class Watchdog:
+    enabled: bool
+    threshold: float
+    interval: float
+    history: int
+
+
+@dataclass
+class CheckIn:
+    workers: int
+    queue_size: int
+    secret: str
+    token_rotation: float
+    session_duration: float
+    replay_ttl: float
+    report_path: str
+    report_batch: int
+    report_interval: float
+    reconcile_batch: int
+    reconcile_interval: float
+    qr_workers: int
+    qr_prerender: int
+
+
 @dataclass
 class Config:
     tgbot: TgBot
+    backend: Backend
+    coworking: Coworking
+    webhook: Webhook
+    fsm: Fsm
+    throttling: Throttling
+    updates: Updates
+    outbound: Outbound
+    metrics: Metrics
+    watchdog: Watchdog
+    check_in: CheckIn
 
 def load_conf(path=None):
     env = Env()
     env.read_env(path=path)
-    return Config(tgbot=TgBot(token=env('BOT_TOKEN')))
+    webhook_enabled = env('BOT_MODE', 'polling') == 'webhook'
+    webhook_base_url = env('WEBHOOK_BASE_URL', '')
+    if webhook_enabled:
+        # Иначе ошибка всплывет только в set_webhook, уже после подключения к сервисам
+        url = urlsplit(webhook_base_url)
+        if url.scheme != 'https' or not url.netloc:
+            raise EnvError(f'BOT_MODE=webhook: WEBHOOK_BASE_URL должен быть публичным https-адресом бота '
+                           f'(например https://bot.example.com), получено {webhook_base_url!r}')
+    return Config(tgbot=TgBot(token=env('BOT_TOKEN')),
+                  backend=Backend(users_url=env('USERS_API_URL', 'http://93.189.231.250:8080/api'),
+                                  spaces_url=env('SPACES_API_URL', 'http://93.189.231.250:8081/api'),
+                                  verify_url=env('VERIFY_API_URL', 'http://93.189.231.250:8082/api'),
+                                  pool_size=env.int('BACKEND_POOL_SIZE', 100),
+                                  users_timeout=env.float('USERS_API_TIMEOUT', 5.0),
+                                  spaces_timeout=env.float('SPACES_API_TIMEOUT', 10.0),
+                                  verify_timeout=env.float('VERIFY_API_TIMEOUT', 5.0),
+                                  users_sync_interval=env.float('USERS_SYNC_INTERVAL', 600.0)),
+                  coworking=Coworking(open_time=env('COWORKING_OPEN_TIME', '09:00'),
+                                      close_time=env('COWORKING_CLOSE_TIME', '21:00'),
+                                      slot_minutes=env.int('COWORKING_SLOT_MINUTES', 60)),
+                  webhook=Webhook(enabled=webhook_enabled,
+                                  base_url=webhook_base_url,
+                                  path=env('WEBHOOK_PATH', '/webhook'),
+                                  secret=env('WEBHOOK_SECRET', ''),
+                                  host=env('WEBHOOK_HOST', '0.0.0.0'),
+                                  port=env.int('WEBHOOK_PORT', 8000),
+                                  drain_timeout=env.float('WEBHOOK_DRAIN_TIMEOUT', 10.0)),
+                  fsm=Fsm(state_ttl=env.float('FSM_STATE_TTL', 24 * 60 * 60),
+                          cache_size=env.int('FSM_CACHE_SIZE', 10_000),
+                          flush_interval=env.float('FSM_FLUSH_INTERVAL', 2.0),
+                          sweep_interval=env.float('FSM_SWEEP_INTERVAL', 60 * 60)),
+                  throttling=Throttling(burst=env.float('THROTTLING_BURST', 5.0),
+                                        rate=env.float('THROTTLING_RATE', 1.5)),
+                  updates=Updates(pool_enabled=env.bool('UPDATE_POOL_ENABLED', True),
+                                  workers=env.int('UPDATE_WORKERS', 256),
+                                  queue_size=env.int('UPDATE_QUEUE_SIZE', 4096),
+                                  shard_size=env.int('UPDATE_SHARD_QUEUE_SIZE', 64),
+                                  overload_policy=env('UPDATE_OVERLOAD_POLICY', 'block'),
+                                  drain_timeout=env.float('UPDATE_DRAIN_TIMEOUT', 10.0)),
+                  outbound=Outbound(global_rate=env.float('OUTBOUND_GLOBAL_RATE', 30.0),
+                                    chat_rate=env.float('OUTBOUND_CHAT_RATE', 1.0),
+                                    group_rate=env.float('OUTBOUND_GROUP_RATE', 20 / 60),
+                                    burst=env.float('OUTBOUND_BURST', 3.0),
+                                    max_retries=env.int('OUTBOUND_MAX_RETRIES', 3),
+                                    max_flood_wait=env.float('OUTBOUND_MAX_FLOOD_WAIT', 60.0)),
+                  metrics=Metrics(enabled=env.bool('METRICS_ENABLED', True),
+                                  host=env('METRICS_HOST', '127.0.0.1'),
+                                  port=env.int('METRICS_PORT', 9100)),
+                  watchdog=Watchdog(enabled=env.bool('LOOP_WATCHDOG_ENABLED', True),
+                                    threshold=env.float('LOOP_LAG_THRESHOLD', 0.1),
+                                    interval=env.float('LOOP_WATCHDOG_INTERVAL', 0.05),
+                                    history=env.int('LOOP_STALLS_HISTORY', 100)),
+                  check_in=CheckIn(workers=env.int('CHECK_IN_WORKERS', 16),
+                                   queue_size=env.int('CHECK_IN_QUEUE_SIZE', 1000),
+                                   secret=env('CHECK_IN_SECRET', ''),
+                                   token_rotation=env.float('CHECK_IN_TOKEN_ROTATION', 30.0),
+                                   session_duration=env.float('CHECK_IN_SESSION_DURATION', 2 * 60 * 60),
+                                   replay_ttl=env.float('CHECK_IN_REPLAY_TTL', 3 * 60 * 60),
+                                   report_path=env('CHECK_IN_REPORT_PATH', ''),
+                                   report_batch=env.int('CHECK_IN_REPORT_BATCH', 100),
+                                   report_interval=env.float('CHECK_IN_REPORT_INTERVAL', 2.0),
+                                   reconcile_batch=env.int('CHECK_IN_RECONCILE_BATCH', 100),
+                                   reconcile_interval=env.float('CHECK_IN_RECONCILE_INTERVAL', 15.0),
+                                   qr_workers=env.int('QR_RENDER_WORKERS', 2),
+                                   qr_prerender=env.int('QR_PRERENDER_PERIODS', 3)))
 
-print('Конфигурация прошла успешно, бот запущен!')
\ No newline at end of file
+print('Конфигурация прошла успешно, бот запущен!')
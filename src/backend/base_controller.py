@@ -0,0 +1,69 @@
+import time
+from typing import Any, Optional
+import aiohttp
+
+from src.services.metrics import backend_errors, backend_latency
+
+
+class BaseApiController:
+    """Базовый контроллер с общей keep-alive сессией для одного сервиса"""
+
+    base_url: str = "/api"
+    session: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    def set_base_url(cls, url: str) -> None:
+        """Установить базовый URL для API"""
+        cls.base_url = url.rstrip('/')
+
+    @classmethod
+    async def start_session(cls, pool_size: int = 100, timeout: float = 10.0) -> None:
+        """
+        Создать пул соединений сервиса
+
+        Args:
+            pool_size (int): Максимальное число одновременных соединений
+            timeout (float): Общий таймаут запроса в секундах
+        """
+        if cls.session is not None and not cls.session.closed:
+            return
+        connector = aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=30)
+        cls.session = aiohttp.ClientSession(connector=connector,
+                                            timeout=aiohttp.ClientTimeout(total=timeout))
+
+    @classmethod
+    async def close_session(cls) -> None:
+        """Закрыть пул соединений сервиса"""
+        if cls.session is not None:
+            await cls.session.close()
+        cls.session = None
+
+    @classmethod
+    async def _request(cls, method: str, path: str, *, endpoint: str, **kwargs: Any) -> Any:
+        """
+        Выполнить запрос к сервису и вернуть JSON ответа
+
+        Args:
+            method (str): HTTP-метод
+            path (str): Путь относительно base_url
+            endpoint (str): Имя метода контроллера (get_users, verify_uuid, ...) для меток метрик
+
+        Raises:
+            aiohttp.ClientError: При ошибке запроса или статусе >= 400
+        """
+        if cls.session is None or cls.session.closed:
+            raise RuntimeError(f"{cls.__name__}: сессия не создана, вызовите start_session()")
+        labels = (f"{cls.__name__}.{endpoint}",)
+        start = time.perf_counter()
+        try:
+            async with cls.session.request(method, f"{cls.base_url}{path}", **kwargs) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+        except aiohttp.ClientResponseError as e:
+            backend_errors.inc(labels + (str(e.status),))
+            raise
+        except Exception as e:
+            backend_errors.inc(labels + (type(e).__name__,))
+            raise
+        finally:
+            backend_latency.observe(labels, time.perf_counter() - start)
@@ -0,0 +1,96 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Iterable, List, Mapping, Optional, Set, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+T = TypeVar("T")
+
+
+class BatchLoader(Generic[K, V]):
+    """Объединение одиночных запросов в пакетные
+
+    Ключи, запрошенные за один проход event loop, загружаются одним вызовом
+    load_many (например, SELECT ... WHERE id IN (...)). Нужен на всплесках, когда
+    сотни апдейтов одновременно делают одинаковые точечные запросы к БД.
+    """
+
+    def __init__(self, load_many: Callable[[List[K]], Awaitable[Mapping[K, V]]], max_batch: int = 500):
+        self.load_many = load_many
+        self.max_batch = max_batch
+        self._waiting: Dict[K, List[asyncio.Future]] = {}
+        self._scheduled = False
+        # Event loop держит на задачи только слабые ссылки: без этого набора пакет может собрать GC
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def load(self, key: K) -> Optional[V]:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(key, []).append(future)
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self._dispatch)
+        return await future
+
+    def _dispatch(self) -> None:
+        self._scheduled = False
+        waiting, self._waiting = self._waiting, {}
+        keys = list(waiting)
+        for start in range(0, len(keys), self.max_batch):
+            batch = keys[start:start + self.max_batch]
+            task = asyncio.create_task(self._load_batch(batch, [waiting[key] for key in batch]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _load_batch(self, keys: List[K], futures: Iterable[List[asyncio.Future]]) -> None:
+        try:
+            values = await self.load_many(keys)
+        except Exception as e:
+            for key_futures in futures:
+                for future in key_futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for key, key_futures in zip(keys, futures):
+            for future in key_futures:
+                if not future.done():
+                    future.set_result(values.get(key))
+
+
+class BatchWriter(Generic[T]):
+    """Объединение одиночных записей в пакетные (group commit)
+
+    Элементы, переданные в write за один проход event loop, сохраняются одним
+    вызовом store_many (одной транзакцией). write возвращается, когда пачка
+    записана, а ошибка записи пробрасывается каждому из ее участников.
+    """
+
+    def __init__(self, store_many: Callable[[List[T]], Awaitable[None]], max_batch: int = 500):
+        self.store_many = store_many
+        self.max_batch = max_batch
+        self._waiting: List[Tuple[T, asyncio.Future]] = []
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def write(self, item: T) -> None:
+        future = asyncio.get_running_loop().create_future()
+        if not self._waiting:
+            asyncio.get_running_loop().call_soon(self._dispatch)
+        self._waiting.append((item, future))
+        await future
+
+    def _dispatch(self) -> None:
+        waiting, self._waiting = self._waiting, []
+        for start in range(0, len(waiting), self.max_batch):
+            task = asyncio.create_task(self._store_batch(waiting[start:start + self.max_batch]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _store_batch(self, batch: List[Tuple[T, asyncio.Future]]) -> None:
+        try:
+            await self.store_many([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
@@ -0,0 +1,52 @@
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+from cachetools import TTLCache
+
+T = TypeVar("T")
+
+
+class CoalescingCache:
+    """TTL-кэш ответов API, в котором одновременные запросы одного ключа
+    объединяются в один запрос к API
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._pending[key] = task
+            task.add_done_callback(partial(self._on_fetched, key))
+        # shield: отмена одного ожидающего не должна отменять запрос для остальных
+        return await asyncio.shield(task)
+
+    def _on_fetched(self, key: Hashable, task: asyncio.Future) -> None:
+        # Результат запроса, начатого до invalidate(), в кэш не попадает
+        if self._pending.get(key) is not task:
+            return
+        del self._pending[key]
+        if not task.cancelled() and task.exception() is None:
+            self._cache[key] = task.result()
+
+    def invalidate(self, key: Hashable) -> None:
+        self._cache.pop(key, None)
+        self._pending.pop(key, None)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._pending.clear()
+
+
+# Доступное время коворкингов по ключу (coworking_id, дата)
+availability_cache = CoalescingCache(maxsize=1024, ttl=30)
+# Результаты проверки QR по UUID: повторные сканы того же кода не ходят в Verify API
+verification_cache = CoalescingCache(maxsize=1024, ttl=10)
@@ -1,5 +1,9 @@
-import requests
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
+from functools import partial
+from typing import Iterable, Optional
+
+from src.backend.base_controller import BaseApiController
+from src.backend.coalescing_cache import verification_cache
 
 
 @dataclass
@@ -9,47 +13,108 @@ class VerifyResponse:
     valid: bool
 
 
-class VerifyApiController:
+@dataclass(frozen=True)
+class CheckInRecord:
+    """Отметка студента, проверенная ботом локально по подписанному токену"""
+    session_id: int
+    issuer_id: int
+    tgID: str
+    checked_at: str
+
+
+class VerifyApiController(BaseApiController):
     """Контроллер для работы с Verify API"""
 
     base_url: str = "/api"
+    # Путь пакетной передачи отметок по токенам; None - передача выключена
+    report_path: Optional[str] = None
 
     @classmethod
-    def set_base_url(cls, url: str) -> None:
-        """Установить базовый URL для API"""
-        cls.base_url = url.rstrip('/')
+    def set_report_path(cls, path: Optional[str]) -> None:
+        """Установить путь приема отметок (CHECK_IN_REPORT_PATH), пустой путь выключает передачу"""
+        cls.report_path = path or None
 
     @classmethod
-    def verify_uuid(cls, uuid: str) -> VerifyResponse:
+    async def verify_uuid(cls, uuid: str, scanned_at: Optional[str] = None) -> VerifyResponse:
         """
         Проверить валидность UUID
 
         Args:
             uuid (str): UUID для проверки
+            scanned_at (Optional[str]): Время сканирования в ISO 8601, если отметка
+                проверяется позже (после недоступности сервиса)
 
         Returns:
             VerifyResponse: Результат проверки с uuid и статусом valid
 
         Raises:
-            requests.RequestException: При ошибке запроса
+            aiohttp.ClientError: При ошибке запроса
         """
-        response = requests.post(f"{cls.base_url}/verify/{uuid}")
-        response.raise_for_status()
-
-        response_data = response.json()
+        request_data = {"scanned_at": scanned_at} if scanned_at is not None else None
+        response_data = await cls._request("POST", f"/verify/{uuid}", endpoint="verify_uuid", json=request_data)
         return VerifyResponse(**response_data)
 
+    @classmethod
+    async def get_cached_verification(cls, uuid: str) -> VerifyResponse:
+        """
+        Проверить UUID через кэш: одновременные и повторные проверки одного QR-кода
+        выполняются одним запросом
+
+        Args:
+            uuid (str): UUID для проверки
+
+        Returns:
+            VerifyResponse: Результат проверки с uuid и статусом valid
+
+        Raises:
+            aiohttp.ClientError: При ошибке запроса
+        """
+        return await verification_cache.get_or_fetch(uuid, partial(cls.verify_uuid, uuid))
+
+    @classmethod
+    async def report_check_ins(cls, check_ins: Iterable[CheckInRecord]) -> dict:
+        """
+        Передать пачку отметок, проверенных ботом локально
+
+        Эндпоинта приема отметок нет в текущем Verify API: его нужно добавить на стороне
+        сервиса (POST report_path с телом {"check_ins": [{session_id, issuer_id, tgID,
+        checked_at}, ...]}, ответ 2xx - пачка принята) и указать путь в CHECK_IN_REPORT_PATH.
+        Пока путь не задан, бот не выдает токены отметки (см. CheckInReporter.enabled).
+
+        Args:
+            check_ins (Iterable[CheckInRecord]): Отметки студентов
+
+        Returns:
+            dict: Ответ сервиса
+
+        Raises:
+            aiohttp.ClientError: При ошибке запроса
+            RuntimeError: Путь приема отметок не задан
+        """
+        if cls.report_path is None:
+            raise RuntimeError(f"{cls.__name__}: путь приема отметок не задан, см. CHECK_IN_REPORT_PATH")
+        request_data = {"check_ins": [asdict(check_in) for check_in in check_ins]}
+        return await cls._request("POST", cls.report_path, endpoint="report_check_ins", json=request_data)
+
 
 VerifyApiController.set_base_url("http://93.189.231.250:8082/api")
 
 # Пример использования:
 if __name__ == "__main__":
-    # Установка базового URL
-    VerifyApiController.set_base_url("http://93.189.231.250:8082/api")
-
-    # Проверка UUID
-    verify_result = VerifyApiController.verify_uuid(
-        "490ebfb4-eae7-4b7c-864e-cc47a93f4b2b"
-    )
-    print(f"UUID: {verify_result.uuid}")
-    print(f"Валиден: {verify_result.valid}")
+    import asyncio
+
+    async def main():
+        # Установка базового URL
+        VerifyApiController.set_base_url("http://93.189.231.250:8082/api")
+        await VerifyApiController.start_session()
+
+        # Проверка UUID
+        verify_result = await VerifyApiController.verify_uuid(
+            "490ebfb4-eae7-4b7c-864e-cc47a93f4b2b"
+        )
+        print(f"UUID: {verify_result.uuid}")
+        print(f"Валиден: {verify_result.valid}")
+
+        await VerifyApiController.close_session()
+
+    asyncio.run(main())
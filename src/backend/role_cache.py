@@ -0,0 +1,42 @@
+from typing import Optional, Tuple
+from cachetools import TTLCache
+
+
+class RoleCache:
+    """Кэш ролей пользователей по Telegram ID
+
+    Найденные роли живут ``ttl`` секунд, отсутствующие в API пользователи
+    (404) - меньший ``negative_ttl``, чтобы новая регистрация подхватывалась быстро.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 300, negative_ttl: float = 30):
+        self._roles = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._missing = TTLCache(maxsize=maxsize, ttl=negative_ttl)
+
+    def lookup(self, tg_id: str) -> Tuple[bool, Optional[str]]:
+        """Вернуть (есть ли запись в кэше, роль или None для отсутствующего пользователя)"""
+        role = self._roles.get(tg_id)
+        if role is not None:
+            return True, role
+        if tg_id in self._missing:
+            return True, None
+        return False, None
+
+    def set_role(self, tg_id: str, role: str) -> None:
+        self._missing.pop(tg_id, None)
+        self._roles[tg_id] = role
+
+    def set_missing(self, tg_id: str) -> None:
+        self._roles.pop(tg_id, None)
+        self._missing[tg_id] = None
+
+    def invalidate(self, tg_id: str) -> None:
+        self._roles.pop(tg_id, None)
+        self._missing.pop(tg_id, None)
+
+    def clear(self) -> None:
+        self._roles.clear()
+        self._missing.clear()
+
+
+role_cache = RoleCache()
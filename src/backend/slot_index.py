@@ -0,0 +1,93 @@
+import time as time_module
+from bisect import bisect_left, insort
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from src.backend.spaces_controller import CoworkingModel
+
+
+def parse_booked_time(value: str) -> Optional[Tuple[date, str]]:
+    """Разобрать 'ГГГГ-ММ-ДД ЧЧ:ММ[:СС]' в (дата, 'ЧЧ:ММ')"""
+    parts = value.replace("T", " ").split()
+    if len(parts) != 2:
+        return None
+    try:
+        booked_date = date.fromisoformat(parts[0])
+    except ValueError:
+        return None
+    return booked_date, parts[1][:5]
+
+
+class CoworkingSlotIndex:
+    """Локальный индекс занятого времени коворкингов
+
+    Строится по одному снимку get_coworkings(): для каждого коворкинга хранится
+    отсортированный список занятых слотов по дням. Свободное время считается
+    как сетка слотов в часы работы минус занятые слоты.
+    """
+
+    def __init__(self, open_time: str = "09:00", close_time: str = "21:00",
+                 slot_minutes: int = 60, ttl: float = 60):
+        self.ttl = ttl
+        self._grid: Tuple[str, ...] = ()
+        self._booked: Dict[str, Dict[date, List[str]]] = {}
+        self._loaded_at: Optional[float] = None
+        self.configure(open_time=open_time, close_time=close_time, slot_minutes=slot_minutes)
+
+    def configure(self, open_time: str, close_time: str, slot_minutes: int) -> None:
+        """Задать часы работы и шаг сетки слотов"""
+        start = datetime.strptime(open_time, "%H:%M")
+        end = datetime.strptime(close_time, "%H:%M")
+        step = timedelta(minutes=slot_minutes)
+        grid = []
+        while start + step <= end:
+            grid.append(start.strftime("%H:%M"))
+            start += step
+        self._grid = tuple(grid)
+
+    def load(self, coworkings: Iterable["CoworkingModel"]) -> None:
+        """Перестроить индекс по снимку списка коворкингов"""
+        booked: Dict[str, Dict[date, List[str]]] = {}
+        for coworking in coworkings:
+            days: Dict[date, List[str]] = {}
+            for value in coworking.booked_time or ():
+                parsed = parse_booked_time(value)
+                if parsed is not None:
+                    days.setdefault(parsed[0], []).append(parsed[1])
+            for slots in days.values():
+                slots.sort()
+            booked[coworking.id] = days
+        self._booked = booked
+        self._loaded_at = time_module.monotonic()
+
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and time_module.monotonic() - self._loaded_at < self.ttl
+
+    def has(self, coworking_id: str) -> bool:
+        return coworking_id in self._booked
+
+    def available_times(self, coworking_id: str, day: date) -> List[str]:
+        """Свободные слоты коворкинга на дату (прошедшие слоты сегодняшнего дня не выдаются)"""
+        booked = self._booked.get(coworking_id, {}).get(day, ())
+        now = datetime.now()
+        earliest = now.strftime("%H:%M") if day == now.date() else ""
+        return [slot for slot in self._grid
+                if slot > earliest and not self._contains(booked, slot)]
+
+    def add_booking(self, coworking_id: str, time: str) -> None:
+        """Отметить слот занятым после успешного бронирования"""
+        parsed = parse_booked_time(time)
+        if parsed is None or coworking_id not in self._booked:
+            return
+        slots = self._booked[coworking_id].setdefault(parsed[0], [])
+        if not self._contains(slots, parsed[1]):
+            insort(slots, parsed[1])
+
+    @staticmethod
+    def _contains(slots, slot: str) -> bool:
+        position = bisect_left(slots, slot)
+        return position < len(slots) and slots[position] == slot
+
+
+coworking_slots = CoworkingSlotIndex()
@@ -1,6 +1,11 @@
-import requests
 from dataclasses import dataclass
+from functools import partial
 from datetime import date, timedelta
+from aiohttp import ClientResponseError
+
+from src.backend.base_controller import BaseApiController
+from src.backend.coalescing_cache import availability_cache
+from src.backend.slot_index import coworking_slots
 
 
 @dataclass
@@ -31,18 +36,13 @@ class AddBookingTime:
     time: str
 
 
-class SpacesApiController:
+class SpacesApiController(BaseApiController):
     """Контроллер для работы с Spaces API"""
 
     base_url: str = "/api"
 
     @classmethod
-    def set_base_url(cls, url: str) -> None:
-        """Установить базовый URL для API"""
-        cls.base_url = url.rstrip('/')
-
-    @classmethod
-    def ping(cls) -> dict[str, str]:
+    async def ping(cls) -> dict[str, str]:
         """
         Проверка доступности сервера
 
@@ -50,14 +50,12 @@ class SpacesApiController:
             dict[str, str]: Ответ сервера с сообщением
 
         Raises:
-            requests.RequestException: При ошибке запроса
+            aiohttp.ClientError: При ошибке запроса
         """
-        response = requests.get(f"{cls.base_url}/ping")
-        response.raise_for_status()
-        return response.json()
+        return await cls._request("GET", "/ping", endpoint="ping")
 
     @classmethod
-    def get_rooms(cls) -> list[RoomModel]:
+    async def get_rooms(cls) -> list[RoomModel]:
         """
         Получить список всех комнат
 
@@ -65,16 +63,13 @@ class SpacesApiController:
             List[RoomModel]: Список комнат
 
         Raises:
-            requests.RequestException: При ошибке запроса
+            aiohttp.ClientError: При ошибке запроса
         """
-        response = requests.get(f"{cls.base_url}/rooms/")
-        response.raise_for_status()
-
-        rooms_data = response.json()
+        rooms_data = await cls._request("GET", "/rooms/", endpoint="get_rooms")
         return [RoomModel(**room_data) for room_data in rooms_data]
 
     @classmethod
-    def update_room_booking(
+    async def update_room_booking(
         cls,
         room_id: str,
         is_booked: bool,
@@ -92,7 +87,7 @@ class SpacesApiController:
             RoomModel: Обновленная комната
 
         Raises:
-            requests.RequestException: При ошибке запроса
+            aiohttp.ClientError: При ошибке запроса
         """
         request_data = {
             "id": room_id,
@@ -100,18 +95,11 @@ class SpacesApiController:
             "booked_by": booked_by
         }
 
-        response = requests.put(
-            f"{cls.base_url}/rooms/",
-            json=request_data,
-            headers={"Content-Type": "application/json"}
-        )
-        response.raise_for_status()
-
-        room_data = response.json()
+        room_data = await cls._request("PUT", "/rooms/", endpoint="update_room_booking", json=request_data)
         return RoomModel(**room_data)
 
     @classmethod
-    def get_room_by_id(cls, room_id: str) -> RoomModel:
+    async def get_room_by_id(cls, room_id: str) -> RoomModel:
         """
         Получить информацию о комнате по ID
 
@@ -122,16 +110,13 @@ class SpacesApiController:
             RoomModel: Данные комнаты
 
         Raises:
-            requests.RequestException: При ошибке запроса (включая 404)
+            aiohttp.ClientError: При ошибке запроса (включая 404)
         """
-        response = requests.get(f"{cls.base_url}/rooms/{room_id}")
-        response.raise_for_status()
-
-        room_data = response.json()
+        room_data = await cls._request("GET", f"/rooms/{room_id}", endpoint="get_room_by_id")
         return RoomModel(**room_data)
 
     @classmethod
-    def get_coworkings(cls) -> list[CoworkingModel]:
+    async def get_coworkings(cls) -> list[CoworkingModel]:
         """
         Получить список всех коворкингов
 
@@ -139,16 +124,16 @@ class SpacesApiController:
             List[CoworkingModel]: Список коворкингов
 
         Raises:
-            requests.RequestException: При ошибке запроса
+            aiohttp.ClientError: При ошибке запроса
         """
-        response = requests.get(f"{cls.base_url}/coworkings/")
-        response.raise_for_status()
-
-        coworkings_data = response.json()
-        return [CoworkingModel(**coworking_data) for coworking_data in coworkings_data]
+        coworkings_data = await cls._request("GET", "/coworkings/", endpoint="get_coworkings")
+        coworkings = [CoworkingModel(**coworking_data) for coworking_data in coworkings_data]
+        # Каждый снимок обновляет локальный индекс слотов
+        coworking_slots.load(coworkings)
+        return coworkings
 
     @classmethod
-    def get_coworking_available_time(
+    async def get_coworking_available_time(
         cls,
         coworking_id: str,
         date_param: date
@@ -164,21 +149,40 @@ class SpacesApiController:
             CoworkingMetaResponse: Доступное время
 
         Raises:
-            requests.RequestException: При ошибке запроса (включая 400, 404)
+            aiohttp.ClientError: При ошибке запроса (включая 400, 404)
         """
         params = {"date": date_param.isoformat()}
 
-        response = requests.get(
-            f"{cls.base_url}/coworkings/{coworking_id}",
-            params=params
-        )
-        response.raise_for_status()
-
-        response_data = response.json()
+        response_data = await cls._request("GET", f"/coworkings/{coworking_id}",
+                                           endpoint="get_coworking_available_time", params=params)
         return CoworkingMetaResponse(**response_data)
 
     @classmethod
-    def add_coworking_booking_time(
+    async def get_cached_available_time(
+        cls,
+        coworking_id: str,
+        date_param: date
+    ) -> CoworkingMetaResponse:
+        """
+        Получить доступное время для коворкинга по дате через кэш доступности
+
+        Args:
+            coworking_id (str): ID коворкинга
+            date_param (date): Дата для проверки доступности
+
+        Returns:
+            CoworkingMetaResponse: Доступное время
+
+        Raises:
+            aiohttp.ClientError: При ошибке запроса (включая 400, 404)
+        """
+        return await availability_cache.get_or_fetch(
+            (coworking_id, date_param),
+            partial(cls.get_coworking_available_time, coworking_id, date_param)
+        )
+
+    @classmethod
+    async def add_coworking_booking_time(
         cls,
         coworking_id: str,
         time: str
@@ -194,32 +198,52 @@ class SpacesApiController:
             AddBookingTime: Добавленное время
 
         Raises:
-            requests.RequestException: При ошибке запроса (включая 400, 409)
+            aiohttp.ClientError: При ошибке запроса (включая 400, 409)
         """
         request_data = {"time": time}
 
-        response = requests.post(
-            f"{cls.base_url}/coworkings/{coworking_id}",
-            json=request_data,
-            headers={"Content-Type": "application/json"}
-        )
-        response.raise_for_status()
-
-        response_data = response.json()
+        try:
+            response_data = await cls._request("POST", f"/coworkings/{coworking_id}",
+                                               endpoint="add_coworking_booking_time", json=request_data)
+        except ClientResponseError as error:
+            # 409 - слот уже занят, значит закэшированная доступность устарела
+            if error.status == 409:
+                cls._invalidate_availability(coworking_id, time)
+                coworking_slots.add_booking(coworking_id, time)
+            raise
+
+        cls._invalidate_availability(coworking_id, time)
+        coworking_slots.add_booking(coworking_id, time)
         return AddBookingTime(**response_data)
 
+    @staticmethod
+    def _invalidate_availability(coworking_id: str, time: str) -> None:
+        """Сбросить кэш доступности для даты из строки 'ГГГГ-ММ-ДД ЧЧ:ММ'"""
+        try:
+            booking_date = date.fromisoformat(time.split()[0])
+        except (ValueError, IndexError):
+            availability_cache.clear()
+            return
+        availability_cache.invalidate((coworking_id, booking_date))
+
 
 SpacesApiController.set_base_url("http://93.189.231.250:8081/api")
 
 
 # Пример использования:
 if __name__ == "__main__":
-    from datetime import date
+    import asyncio
+
+    async def main():
+        # Установка базового URL
+        SpacesApiController.set_base_url("http://93.189.231.250:8081/api")
+        await SpacesApiController.start_session()
+
+        all_rooms = await SpacesApiController.get_rooms()
 
-    # Установка базового URL
-    SpacesApiController.set_base_url("http://93.189.231.250:8081/api")
+        coworkings = await SpacesApiController.get_coworkings()
+        print(coworkings, all_rooms)
 
-    all_rooms = SpacesApiController.get_rooms()
+        await SpacesApiController.close_session()
 
-    coworkings = SpacesApiController.get_coworkings()
-    print(coworkings, all_rooms)
+    asyncio.run(main())
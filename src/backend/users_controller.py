@@ -1,6 +1,13 @@
+import time
 from typing import Optional, List, Dict, Any
-import requests
 from dataclasses import dataclass
+from aiohttp import ClientResponseError
+
+from src.backend.base_controller import BaseApiController
+from src.backend.batch_loader import BatchLoader
+from src.backend.role_cache import role_cache
+from src.database import db_functions
+from src.database.database import async_session_maker
 
 
 @dataclass
@@ -26,18 +33,22 @@ class ApiResponse:
     message: Optional[str] = None
 
 
-class BackendUsersController:
+async def _load_mirror_users(tg_ids: List[int]) -> Dict[int, Any]:
+    async with async_session_maker() as session:
+        return await db_functions.get_users_by_ids(session, tg_ids)
+
+
+# Одновременные проверки ролей (всплеск отметок по QR) читают зеркало одним запросом
+mirror_users = BatchLoader(_load_mirror_users)
+
+
+class BackendUsersController(BaseApiController):
     """Контроллер для работы с Backend Users Service API"""
 
     base_url: str = "/api"
 
     @classmethod
-    def set_base_url(cls, url: str) -> None:
-        """Установить базовый URL для API"""
-        cls.base_url = url.rstrip('/')
-
-    @classmethod
-    def ping(cls) -> Dict[str, str]:
+    async def ping(cls) -> Dict[str, str]:
         """
         Проверка доступности сервера
 
@@ -45,14 +56,12 @@ class BackendUsersController:
             Dict[str, str]: Ответ сервера с сообщением
 
         Raises:
-            requests.RequestException: При ошибке запроса
+            aiohttp.ClientError: При ошибке запроса
         """
-        response = requests.get(f"{cls.base_url}/ping")
-        response.raise_for_status()
-        return response.json()
+        return await cls._request("GET", "/ping", endpoint="ping")
 
     @classmethod
-    def get_users(cls, role: Optional[str] = None) -> List[User]:
+    async def get_users(cls, role: Optional[str] = None) -> List[User]:
         """
         Получить список пользователей
 
@@ -63,20 +72,17 @@ class BackendUsersController:
             List[User]: Список пользователей
 
         Raises:
-            requests.RequestException: При ошибке запроса
+            aiohttp.ClientError: При ошибке запроса
         """
         params = {}
         if role is not None:
             params['role'] = role
 
-        response = requests.get(f"{cls.base_url}/users/", params=params)
-        response.raise_for_status()
-
-        users_data = response.json()
+        users_data = await cls._request("GET", "/users/", endpoint="get_users", params=params)
         return [User(**user_data) for user_data in users_data]
 
     @classmethod
-    def create_user(cls, tgID: str, language: str) -> ApiResponse:
+    async def create_user(cls, tgID: str, language: str) -> ApiResponse:
         """
         Создать пользователя
 
@@ -88,25 +94,22 @@ class BackendUsersController:
             ApiResponse: Статус создания пользователя
 
         Raises:
-            requests.RequestException: При ошибке запроса
+            aiohttp.ClientError: При ошибке запроса
         """
         request_data = {
             "tgID": tgID,
             "language": language
         }
 
-        response = requests.post(
-            f"{cls.base_url}/users/",
-            json=request_data,
-            headers={"Content-Type": "application/json"}
-        )
-        response.raise_for_status()
-
-        response_data = response.json()
+        response_data = await cls._request("POST", "/users/", endpoint="create_user", json=request_data)
+        role_cache.invalidate(str(tgID))
+        # Роль назначает сервис, в зеркало пишем только язык - роль подтянется при первой проверке
+        async with async_session_maker() as session:
+            await db_functions.save_user(session, tgID, language=language)
         return ApiResponse(status=response_data["status"])
 
     @classmethod
-    def get_user_by_tg_id(cls, tgID: str) -> User:
+    async def get_user_by_tg_id(cls, tgID: str) -> User:
         """
         Получить пользователя по Telegram ID
 
@@ -117,16 +120,70 @@ class BackendUsersController:
             User: Данные пользователя
 
         Raises:
-            requests.RequestException: При ошибке запроса
+            aiohttp.ClientError: При ошибке запроса
         """
-        response = requests.get(f"{cls.base_url}/users/{tgID}")
-        response.raise_for_status()
-
-        user_data = response.json()
+        user_data = await cls._request("GET", f"/users/{tgID}", endpoint="get_user_by_tg_id")
         return User(**user_data)
 
     @classmethod
-    def update_user(
+    async def get_user_role(cls, tgID: str) -> Optional[str]:
+        """
+        Получить роль пользователя: из кэша ролей, затем из локального зеркала в БД,
+        и только если пользователя нет локально - из API
+
+        Args:
+            tgID (str): Telegram ID пользователя
+
+        Returns:
+            Optional[str]: Роль пользователя или None, если пользователь не найден
+
+        Raises:
+            aiohttp.ClientError: При ошибке запроса, кроме 404
+        """
+        tgID = str(tgID)
+        cached, role = role_cache.lookup(tgID)
+        if cached:
+            return role
+
+        local_user = await mirror_users.load(int(tgID))
+        if local_user is not None and local_user.role is not None:
+            role_cache.set_role(tgID, local_user.role)
+            return local_user.role
+
+        try:
+            user = await cls.get_user_by_tg_id(tgID)
+        except ClientResponseError as error:
+            if error.status == 404:
+                role_cache.set_missing(tgID)
+                return None
+            raise
+
+        role_cache.set_role(tgID, user.role)
+        async with async_session_maker() as session:
+            await db_functions.save_user(session, tgID, role=user.role, language=user.language)
+        return user.role
+
+    @classmethod
+    async def sync_users_mirror(cls) -> int:
+        """
+        Полностью синхронизировать локальное зеркало пользователей с API
+
+        Returns:
+            int: Количество пользователей в зеркале
+
+        Raises:
+            aiohttp.ClientError: При ошибке запроса
+        """
+        fetched_at = time.time()
+        users = await cls.get_users()
+        async with async_session_maker() as session:
+            count = await db_functions.replace_users(
+                session, ((user.tgID, user.role, user.language) for user in users), fetched_at=fetched_at)
+        role_cache.clear()
+        return count
+
+    @classmethod
+    async def update_user(
         cls,
         tgID: str,
         role: Optional[str] = None,
@@ -144,7 +201,7 @@ class BackendUsersController:
             ApiResponse: Статус обновления пользователя
 
         Raises:
-            requests.RequestException: При ошибке запроса
+            aiohttp.ClientError: При ошибке запроса
         """
         params = {}
         if role is not None:
@@ -152,14 +209,15 @@ class BackendUsersController:
         if language is not None:
             params['language'] = language
 
-        response = requests.put(f"{cls.base_url}/users/{tgID}", params=params)
-        response.raise_for_status()
-
-        response_data = response.json()
+        response_data = await cls._request("PUT", f"/users/{tgID}", endpoint="update_user", params=params)
+        if role is not None:
+            role_cache.set_role(str(tgID), role)
+        async with async_session_maker() as session:
+            await db_functions.save_user(session, tgID, role=role, language=language)
         return ApiResponse(status=response_data["status"])
 
     @classmethod
-    def delete_user(cls, tgID: str, fromUserID: str) -> ApiResponse:
+    async def delete_user(cls, tgID: str, fromUserID: str) -> ApiResponse:
         """
         Удалить пользователя (только админ)
 
@@ -171,15 +229,14 @@ class BackendUsersController:
             ApiResponse: Статус удаления пользователя
 
         Raises:
-            requests.RequestException: При ошибке запроса (включая 403 Forbidden)
+            aiohttp.ClientError: При ошибке запроса (включая 403 Forbidden)
         """
         params = {"fromUserID": fromUserID}
 
-        response = requests.delete(
-            f"{cls.base_url}/users/{tgID}", params=params)
-        response.raise_for_status()
-
-        response_data = response.json()
+        response_data = await cls._request("DELETE", f"/users/{tgID}", endpoint="delete_user", params=params)
+        role_cache.set_missing(str(tgID))
+        async with async_session_maker() as session:
+            await db_functions.delete_user(session, tgID)
         return ApiResponse(status=response_data["status"])
 
 
@@ -187,8 +244,16 @@ BackendUsersController.set_base_url("http://93.189.231.250:8080/api")
 
 # Пример использования:
 if __name__ == "__main__":
-    # Установка базового URL
-    BackendUsersController.set_base_url("http://93.189.231.250:8080/api")
+    import asyncio
+
+    async def main():
+        # Установка базового URL
+        BackendUsersController.set_base_url("http://93.189.231.250:8080/api")
+        await BackendUsersController.start_session()
+
+        all_users = await BackendUsersController.get_users()
+        print(all_users)
+
+        await BackendUsersController.close_session()
 
-    all_users = BackendUsersController.get_users()
-    print(all_users)
+    asyncio.run(main())
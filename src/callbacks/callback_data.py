@@ -36,3 +36,8 @@ class GroupReportCallback(CallbackData, prefix="group_report"):
 
 class FAQCallback2(CallbackData, prefix="faq2"):
     faq: str
+
+
+class CheckInSessionCallback(CallbackData, prefix="ci_session"):
+    action: str
+    session_id: int
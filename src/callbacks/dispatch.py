@@ -0,0 +1,111 @@
+from typing import Any, Callable, Dict, Optional, Tuple, Type, Union
+
+from aiogram import BaseMiddleware, Router
+from aiogram.dispatcher.event.handler import CallbackType, FilterObject, HandlerObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery, TelegramObject
+
+CALLBACK_SEPARATOR = ":"
+
+
+def parse_callback_prefix(data: Optional[str]) -> Optional[str]:
+    """Префикс callback_data: 'faq2:contacts' -> 'faq2', 'menu' -> 'menu'"""
+    if data is None:
+        return None
+    return data.split(CALLBACK_SEPARATOR, 1)[0]
+
+
+class CallbackPrefixMiddleware(BaseMiddleware):
+    """Разбирает префикс callback_data один раз на апдейт и заводит кэш распакованных CallbackData"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Any],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        data['callback_prefix'] = parse_callback_prefix(event.data)
+        data['callback_cache'] = {}
+        return await handler(event, data)
+
+
+class CallbackIndex:
+    """Индекс callback-хендлеров роутера по префиксу callback_data
+
+    В роутере регистрируется один хендлер, который по префиксу находит нужный
+    хендлер словарем, вместо перебора цепочки фильтров F.data == ... и XCallback.filter().
+    Регистрация:
+
+        callbacks = CallbackIndex(router)
+
+        @callbacks("menu")                        # callback_data == "menu"
+        @callbacks(FAQCallback)                   # префикс FAQCallback, хендлер получит callback_data
+        @callbacks(TimeCallback, flags={...})     # флаги доступны middleware через get_flag
+    """
+
+    def __init__(self, router: Router):
+        self._handlers: Dict[str, Tuple[HandlerObject, Optional[Type[CallbackData]]]] = {}
+        router.callback_query.register(self._dispatch, self._match)
+
+    def __call__(
+        self,
+        key: Union[str, Type[CallbackData]],
+        *filters: CallbackType,
+        flags: Optional[Dict[str, Any]] = None
+    ) -> Callable[[CallbackType], CallbackType]:
+        def decorator(callback: CallbackType) -> CallbackType:
+            self.register(callback, key, *filters, flags=flags)
+            return callback
+        return decorator
+
+    def register(
+        self,
+        callback: CallbackType,
+        key: Union[str, Type[CallbackData]],
+        *filters: CallbackType,
+        flags: Optional[Dict[str, Any]] = None
+    ) -> None:
+        callback_data_cls = None
+        if isinstance(key, type) and issubclass(key, CallbackData):
+            callback_data_cls, key = key, key.__prefix__
+        if key in self._handlers:
+            raise ValueError(f"Callback prefix {key!r} is already registered")
+        handler = HandlerObject(callback=callback, filters=[FilterObject(filter_) for filter_ in filters],
+                                flags=flags or {})
+        self._handlers[key] = (handler, callback_data_cls)
+
+    async def _match(self, callback: CallbackQuery, **kwargs: Any) -> Union[bool, Dict[str, Any]]:
+        prefix = kwargs.get('callback_prefix') or parse_callback_prefix(callback.data)
+        entry = self._handlers.get(prefix)
+        if entry is None:
+            return False
+        handler, callback_data_cls = entry
+
+        # "handler" подменяется на найденный хендлер, чтобы get_flag во внутренних middleware видел его флаги
+        result: Dict[str, Any] = {'handler': handler}
+        if callback_data_cls is None:
+            if callback.data != prefix:
+                return False
+        else:
+            cache = kwargs.get('callback_cache')
+            unpacked = cache.get(callback_data_cls) if cache is not None else None
+            if unpacked is None:
+                try:
+                    unpacked = callback_data_cls.unpack(callback.data)
+                except (TypeError, ValueError):
+                    return False
+                if cache is not None:
+                    cache[callback_data_cls] = unpacked
+            result['callback_data'] = unpacked
+
+        if handler.filters:
+            kwargs.update(result)
+            passed, data = await handler.check(callback, **kwargs)
+            if not passed:
+                return False
+            result.update(data)
+        return result
+
+    @staticmethod
+    async def _dispatch(callback: CallbackQuery, handler: HandlerObject, **kwargs: Any) -> Any:
+        return await handler.call(callback, handler=handler, **kwargs)
@@ -1,10 +1,216 @@
-from typing import Type
+import time
+from typing import Iterable, Optional, Union
 
-from aiogram.types import Message, User
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import User
+
+from src.database.models import CheckInReplay, CheckInReport, CheckInScan, Mailing, MailingRecipient, MailingStatus, \
+    RecipientStatus, ScanStatus, SyncState, User
+
+USERS_SYNC = "users"
 
 # Логика работы с базой данных
 # Функции добавления данных о пользователе и их использовании
 
+
+async def get_user(session: AsyncSession, tg_id: Union[int, str]) -> Optional[User]:
+    return await session.get(User, int(tg_id))
+
+
+async def get_users_by_ids(session: AsyncSession, tg_ids: Iterable[int]) -> dict[int, User]:
+    """Пользователи зеркала по списку ID одним запросом"""
+    result = await session.execute(select(User).where(User.id.in_(list(tg_ids))))
+    return {user.id: user for user in result.scalars()}
+
+
+async def get_user_ids(session: AsyncSession, role: Optional[str] = None) -> list[int]:
+    """ID пользователей из локального зеркала, с фильтром по роли (по индексу)"""
+    query = select(User.id)
+    if role is not None:
+        query = query.where(User.role == role)
+    result = await session.execute(query)
+    return list(result.scalars())
+
+
+async def save_user(
+    session: AsyncSession,
+    tg_id: Union[int, str],
+    role: Optional[str] = None,
+    language: Optional[str] = None
+) -> None:
+    """Добавить пользователя в зеркало или обновить переданные поля"""
+    # synced_at обновляется всегда: идущая параллельно синхронизация не удалит свежую строку
+    values = {"id": int(tg_id), "synced_at": time.time()}
+    if role is not None:
+        values["role"] = role
+    if language is not None:
+        values["language"] = language
+    statement = sqlite_insert(User).values(**values)
+    updated = {key: value for key, value in values.items() if key != "id"}
+    statement = statement.on_conflict_do_update(index_elements=[User.id], set_=updated)
+    await session.execute(statement)
+    await session.commit()
+
+
+async def delete_user(session: AsyncSession, tg_id: Union[int, str]) -> None:
+    await session.execute(delete(User).where(User.id == int(tg_id)))
+    await session.commit()
+
+
+async def replace_users(session: AsyncSession, users: Iterable[tuple[Union[int, str], str, str]],
+                        fetched_at: float) -> int:
+    """
+    Полная синхронизация зеркала со списком (tg_id, role, language) из API.
+
+    fetched_at - время начала запроса списка. Все пользователи пишутся одним bulk
+    upsert с отметкой synced_at, затем удаляются строки, которые не пришли из API
+    и не записывались ботом после fetched_at. Успех синхронизации отмечается в
+    sync_state. Возвращает число пользователей.
+    """
+    synced_at = time.time()
+    rows = [{"id": int(tg_id), "role": role, "language": language, "synced_at": synced_at}
+            for tg_id, role, language in users]
+    if rows:
+        statement = sqlite_insert(User)
+        await session.execute(statement.on_conflict_do_update(
+            index_elements=[User.id],
+            set_={"role": statement.excluded.role, "language": statement.excluded.language,
+                  "synced_at": statement.excluded.synced_at}
+        ), rows)
+    await session.execute(delete(User).where(User.synced_at < fetched_at))
+    statement = sqlite_insert(SyncState).values(name=USERS_SYNC, completed_at=synced_at)
+    await session.execute(statement.on_conflict_do_update(index_elements=[SyncState.name],
+                                                          set_={"completed_at": synced_at}))
+    await session.commit()
+    return len(rows)
+
+
+async def get_sync_completed_at(session: AsyncSession, name: str = USERS_SYNC) -> Optional[float]:
+    """Время последней успешной полной синхронизации; None - ее еще не было"""
+    state = await session.get(SyncState, name)
+    return state.completed_at if state is not None else None
+
+
+async def create_mailing(
+    session: AsyncSession,
+    from_chat_id: int,
+    message_id: int,
+    progress_chat_id: int,
+    progress_message_id: int,
+    chat_ids: Iterable[Union[int, str]]
+) -> Mailing:
+    """Сохранить рассылку и список ее получателей одной транзакцией"""
+    mailing = Mailing(from_chat_id=from_chat_id, message_id=message_id,
+                      progress_chat_id=progress_chat_id, progress_message_id=progress_message_id)
+    session.add(mailing)
+    await session.flush()
+
+    recipients = [{"job_id": mailing.id, "position": position, "chat_id": str(chat_id)}
+                  for position, chat_id in enumerate(chat_ids)]
+    if recipients:
+        await session.execute(insert(MailingRecipient), recipients)
+    await session.commit()
+    return mailing
+
+
+async def get_running_mailings(session: AsyncSession) -> list[Mailing]:
+    result = await session.execute(
+        select(Mailing).where(Mailing.status == MailingStatus.RUNNING.value).order_by(Mailing.id))
+    return list(result.scalars())
+
+
+async def get_pending_recipients(session: AsyncSession, job_id: int) -> list[tuple[int, str]]:
+    """Получатели, которым сообщение еще не отправлено, в порядке очереди"""
+    result = await session.execute(
+        select(MailingRecipient.position, MailingRecipient.chat_id)
+        .where(MailingRecipient.job_id == job_id, MailingRecipient.status == RecipientStatus.PENDING.value)
+        .order_by(MailingRecipient.position))
+    return [tuple(row) for row in result]
+
+
+async def count_recipients_by_status(session: AsyncSession, job_id: int) -> dict[str, int]:
+    result = await session.execute(
+        select(MailingRecipient.status, func.count())
+        .where(MailingRecipient.job_id == job_id)
+        .group_by(MailingRecipient.status))
+    return dict(result.all())
+
+
+async def save_recipient_statuses(session: AsyncSession, job_id: int, statuses: Iterable[tuple[int, str]]) -> None:
+    """Записать статусы доставки пачкой: одна транзакция на всю пачку"""
+    rows = [{"job_id": job_id, "position": position, "status": status} for position, status in statuses]
+    if rows:
+        await session.execute(update(MailingRecipient), rows)
+    await session.commit()
+
+
+async def finish_mailing(session: AsyncSession, job_id: int,
+                         status: MailingStatus = MailingStatus.DONE) -> None:
+    await session.execute(update(Mailing).where(Mailing.id == job_id)
+                          .values(status=status.value))
+    await session.commit()
+
+
+async def add_check_in_scan(session: AsyncSession, uuid: str, tg_id: int, chat_id: int, scanned_at: float) -> None:
+    """Сохранить отметку в офлайн-очередь до сверки с Verify Service"""
+    await session.execute(insert(CheckInScan).values(uuid=uuid, tg_id=tg_id, chat_id=chat_id,
+                                                     scanned_at=scanned_at, status=ScanStatus.PENDING.value))
+    await session.commit()
+
+
+async def get_pending_scans(session: AsyncSession, limit: int) -> list[CheckInScan]:
+    """Самые старые несверенные отметки (по индексу status, id)"""
+    result = await session.execute(select(CheckInScan).where(CheckInScan.status == ScanStatus.PENDING.value)
+                                   .order_by(CheckInScan.id).limit(limit))
+    return list(result.scalars())
+
+
+async def count_pending_scans(session: AsyncSession) -> int:
+    result = await session.execute(select(func.count()).select_from(CheckInScan)
+                                   .where(CheckInScan.status == ScanStatus.PENDING.value))
+    return result.scalar_one()
+
+
+async def save_scan_statuses(session: AsyncSession, statuses: Iterable[tuple[int, str]]) -> None:
+    """Записать итоги сверки пачкой: одна транзакция на всю пачку"""
+    rows = [{"id": scan_id, "status": status} for scan_id, status in statuses]
+    if rows:
+        await session.execute(update(CheckInScan), rows)
+    await session.commit()
+
+
+async def add_check_in_reports(session: AsyncSession, reports: Iterable[dict]) -> None:
+    """Записать отметки в outbox и их ключи защиты от повтора одной транзакцией
+
+    reports - словари с session_id, issuer_id, tg_id, checked_at и seen_at
+    """
+    reports = list(reports)
+    if reports:
+        await session.execute(insert(CheckInReport), [
+            {key: report[key] for key in ("session_id", "issuer_id", "tg_id", "checked_at")} for report in reports])
+        statement = sqlite_insert(CheckInReplay).on_conflict_do_nothing(
+            index_elements=[CheckInReplay.session_id, CheckInReplay.tg_id])
+        await session.execute(statement, [
+            {key: report[key] for key in ("session_id", "tg_id", "seen_at")} for report in reports])
+    await session.commit()
+
+
+async def get_check_in_reports(session: AsyncSession, limit: int) -> list[CheckInReport]:
+    """Самые старые непереданные отметки"""
+    result = await session.execute(select(CheckInReport).order_by(CheckInReport.id).limit(limit))
+    return list(result.scalars())
+
+
+async def delete_check_in_reports(session: AsyncSession, report_ids: Iterable[int]) -> None:
+    await session.execute(delete(CheckInReport).where(CheckInReport.id.in_(list(report_ids))))
+    await session.commit()
+
+
+async def load_check_in_replays(session: AsyncSession, since: float) -> list[tuple[int, int]]:
+    """Ключи (session_id, tg_id) не старше since; более старые записи удаляются"""
+    await session.execute(delete(CheckInReplay).where(CheckInReplay.seen_at < since))
+    await session.commit()
+    result = await session.execute(select(CheckInReplay.session_id, CheckInReplay.tg_id))
+    return [(session_id, tg_id) for session_id, tg_id in result]
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from sqlalchemy import delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.future import select
+
+from src.database.models import FSMRecord
+
+logger = logging.getLogger(__name__)
+
+
+class _Record:
+    # payload - data, уже сериализованные в JSON: ошибка сериализации всплывает в set_data,
+    # а не в flush, где одно плохое значение остановило бы запись состояний всех пользователей
+    __slots__ = ("state", "data", "payload", "updated_at")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None,
+                 payload: str = "{}", updated_at: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.payload = payload
+        self.updated_at = updated_at
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в AdminBot.db с кэшем в памяти и отложенной записью
+
+    - Последние cache_size ключей лежат в LRU-кэше, остальные читаются из БД.
+    - Изменения копятся в буфере и пишутся в БД одной транзакцией раз в flush_interval секунд.
+    - Состояния, которые не менялись дольше ttl секунд, считаются брошенными и удаляются
+      из БД раз в sweep_interval секунд.
+    """
+
+    def __init__(
+        self,
+        session_maker: async_sessionmaker,
+        ttl: float = 24 * 60 * 60,
+        cache_size: int = 10_000,
+        flush_interval: float = 2,
+        sweep_interval: float = 60 * 60,
+        key_builder: Optional[KeyBuilder] = None
+    ):
+        self.session_maker = session_maker
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self._swept_at = 0.0
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        # Буфер отложенной записи: последняя версия каждого измененного ключа
+        self._pending: Dict[str, _Record] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        """Количество записей в памяти (кэш + буфер записи, без повторов)"""
+        return len(self._cache) + sum(1 for key in self._pending if key not in self._cache)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get_record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get_record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        payload = json.dumps(data)
+        record = await self._get_record(key)
+        record.data = data.copy()
+        record.payload = payload
+        self._mark_dirty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get_record(key)).data.copy()
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            # Прерванный посреди записи flush возвращает свою пачку в буфер, дожидаемся этого
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Записать накопленные изменения и удалить из БД брошенные состояния"""
+        async with self._flush_lock:
+            now = time.time()
+            sweep = now - self._swept_at >= self.sweep_interval
+            if not self._pending and not sweep:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                upserts = [{"key": key, "state": record.state, "data": record.payload,
+                            "updated_at": record.updated_at}
+                           for key, record in batch.items() if not record.is_empty()]
+                deletes = [key for key, record in batch.items() if record.is_empty()]
+                async with self.session_maker() as session:
+                    if upserts:
+                        statement = sqlite_insert(FSMRecord)
+                        await session.execute(statement.on_conflict_do_update(
+                            index_elements=[FSMRecord.key],
+                            set_={"state": statement.excluded.state, "data": statement.excluded.data,
+                                  "updated_at": statement.excluded.updated_at}
+                        ), upserts)
+                    if deletes:
+                        await session.execute(delete(FSMRecord).where(FSMRecord.key.in_(deletes)))
+                    if sweep:
+                        await session.execute(delete(FSMRecord).where(FSMRecord.updated_at < now - self.ttl))
+                    await session.commit()
+                if sweep:
+                    self._swept_at = now
+            except BaseException:
+                # Не теряем изменения (и при отмене задачи flush): вернем их в буфер,
+                # если ключ не успели перезаписать
+                for key, record in batch.items():
+                    self._pending.setdefault(key, record)
+                raise
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось сохранить FSM-состояния")
+
+    def _mark_dirty(self, key: StorageKey, record: _Record) -> None:
+        record.updated_at = time.time()
+        self._pending[self.key_builder.build(key)] = record
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _get_record(self, key: StorageKey) -> _Record:
+        db_key = self.key_builder.build(key)
+        record = self._cache.get(db_key) or self._pending.get(db_key)
+        if record is None:
+            record = await self._load(db_key)
+            # Пока шел запрос, ключ мог быть записан другим апдейтом
+            record = self._cache.get(db_key) or self._pending.get(db_key) or record
+
+        if record.updated_at and record.updated_at < time.time() - self.ttl:
+            record = _Record()
+
+        self._cache[db_key] = record
+        self._cache.move_to_end(db_key)
+        if len(self._cache) > self.cache_size:
+            # Вытесняемая запись, если она не сохранена, остается в буфере записи до flush
+            self._cache.popitem(last=False)
+        return record
+
+    async def _load(self, db_key: str) -> _Record:
+        async with self.session_maker() as session:
+            result = await session.execute(select(FSMRecord).where(FSMRecord.key == db_key))
+            row = result.scalar_one_or_none()
+        if row is None:
+            return _Record()
+        return _Record(state=row.state, data=json.loads(row.data), payload=row.data, updated_at=row.updated_at)
@@ -1,7 +1,7 @@
 from sqlalchemy.orm import relationship
 
 from src.database.database import Base
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, BigInteger, DateTime, func
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, BigInteger, DateTime, Float, Text, func, Index
 from sqlalchemy import Enum as SQLEnum
 from enum import Enum
 from datetime import datetime, timedelta
@@ -15,13 +15,147 @@ class SubscriptionType(str, Enum):
 
 
 class User(Base):
+    """Локальное зеркало пользователей Users Service"""
     __tablename__ = 'users'
 
     id = Column(BigInteger, primary_key=True, index=True, autoincrement=False)
 
-    username = Column(String, nullable=False)
+    # None - пользователь создан ботом, роль еще не получена из API
+    role = Column(String, nullable=True, index=True)
 
-    first_name = Column(String, nullable=False)
+    language = Column(String, nullable=True)
 
+    # Время последней записи строки: полной синхронизацией или точечно ботом.
+    # Синхронизация удаляет только строки старше момента, когда она запросила список из API
+    synced_at = Column(Float, nullable=False, default=0.0)
 
 
+class SyncState(Base):
+    """Время последней успешной полной синхронизации (по имени зеркала)"""
+    __tablename__ = 'sync_state'
+
+    name = Column(String, primary_key=True)
+
+    completed_at = Column(Float, nullable=False)
+
+
+class MailingStatus(str, Enum):
+    RUNNING = "running"
+    DONE = "done"
+    # Остановлена ошибкой (например, не записались статусы получателей) и не продолжается
+    FAILED = "failed"
+
+
+class RecipientStatus(str, Enum):
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    BLOCKED = "blocked"
+    FAILED = "failed"
+
+
+class Mailing(Base):
+    __tablename__ = 'mailings'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    # Сообщение администратора, копия которого рассылается
+    from_chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(BigInteger, nullable=False)
+
+    # Сообщение, в котором выводится прогресс рассылки
+    progress_chat_id = Column(BigInteger, nullable=False)
+    progress_message_id = Column(BigInteger, nullable=False)
+
+    status = Column(String, nullable=False, default=MailingStatus.RUNNING.value, index=True)
+
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+
+class MailingRecipient(Base):
+    __tablename__ = 'mailing_recipients'
+
+    job_id = Column(Integer, ForeignKey('mailings.id', ondelete='CASCADE'), primary_key=True)
+
+    position = Column(Integer, primary_key=True, autoincrement=False)
+
+    chat_id = Column(String, nullable=False)
+
+    status = Column(String, nullable=False, default=RecipientStatus.PENDING.value)
+
+    # Выборка неотправленных и подсчет статусов идут по индексу, без сканирования всей рассылки
+    __table_args__ = (Index('ix_mailing_recipients_job_status', 'job_id', 'status', 'position'),)
+
+
+class FSMRecord(Base):
+    __tablename__ = 'fsm_records'
+
+    # Ключ StorageKey, собранный DefaultKeyBuilder
+    key = Column(String, primary_key=True)
+
+    state = Column(String, nullable=True)
+
+    # Данные FSM в JSON
+    data = Column(Text, nullable=False, default='{}')
+
+    # Время последней записи (time.time()), по нему удаляются брошенные состояния
+    updated_at = Column(Float, nullable=False, index=True)
+
+
+class ScanStatus(str, Enum):
+    PENDING = "pending"
+    CONFIRMED = "confirmed"
+    REJECTED = "rejected"
+
+
+class CheckInScan(Base):
+    """Отметка по QR-коду, принятая, пока Verify Service был недоступен
+
+    Отметки не удаляются. Фоновая сверка меняет у записи только status
+    (pending -> confirmed/rejected), остальные поля после вставки не меняются.
+    """
+    __tablename__ = 'check_in_scans'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    uuid = Column(String, nullable=False)
+
+    tg_id = Column(BigInteger, nullable=False)
+
+    # Чат студента, куда придет итоговый результат
+    chat_id = Column(BigInteger, nullable=False)
+
+    # Время сканирования (time.time()), передается в Verify Service при сверке
+    scanned_at = Column(Float, nullable=False)
+
+    status = Column(String, nullable=False, default=ScanStatus.PENDING.value)
+
+    # Неотправленные отметки выбираются по индексу в порядке поступления
+    __table_args__ = (Index('ix_check_in_scans_status', 'status', 'id'),)
+
+
+class CheckInReport(Base):
+    """Outbox отметок по подписанному токену: строка удаляется после передачи в Verify Service"""
+    __tablename__ = 'check_in_reports'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    session_id = Column(BigInteger, nullable=False)
+
+    issuer_id = Column(BigInteger, nullable=False)
+
+    tg_id = Column(BigInteger, nullable=False)
+
+    # Время отметки в ISO 8601, передается сервису как есть
+    checked_at = Column(String, nullable=False)
+
+
+class CheckInReplay(Base):
+    """Студенты, уже отметившиеся в сессии: защита от повторной отметки переживает перезапуск"""
+    __tablename__ = 'check_in_replays'
+
+    session_id = Column(BigInteger, primary_key=True, autoincrement=False)
+
+    tg_id = Column(BigInteger, primary_key=True, autoincrement=False)
+
+    # time.time() отметки, по нему удаляются записи старше CHECK_IN_REPLAY_TTL
+    seen_at = Column(Float, nullable=False, index=True)
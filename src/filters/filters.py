@@ -0,0 +1,33 @@
+from typing import Any, Optional, Union
+
+from aiogram import Router
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.filters import BaseFilter
+from aiogram.types import Message, CallbackQuery, TelegramObject
+
+
+class RoleFilter(BaseFilter):
+    """Проверка роли, заранее определенной RoleMiddleware (data['role'])"""
+
+    def __init__(self, allowed_role: str):
+        self.allowed_role = allowed_role
+
+    async def __call__(self, event: Union[Message, CallbackQuery], role: Optional[str] = None) -> bool:
+        return role == self.allowed_role
+
+
+class RoleRouter(Router):
+    """Роутер, в который попадают только апдейты пользователей с заданной ролью
+
+    Роль берется из data['role'], поэтому апдейты остальных пользователей
+    пропускают роутер целиком, без проверки фильтров его хендлеров.
+    """
+
+    def __init__(self, role: str, *, name: Optional[str] = None):
+        super().__init__(name=name)
+        self.role = role
+
+    async def propagate_event(self, update_type: str, event: TelegramObject, **kwargs: Any) -> Any:
+        if kwargs.get('role') != self.role:
+            return UNHANDLED
+        return await super().propagate_event(update_type=update_type, event=event, **kwargs)
@@ -2,6 +2,7 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import BaseFilter
 from typing import Union
 import asyncio
+from html import escape
 
 from aiogram import Router, Bot, F, BaseMiddleware
 from aiogram.dispatcher.event.bases import CancelHandler
@@ -16,77 +17,30 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import State, default_state, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.token import TokenValidationError
-from requests import HTTPError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from src.callbacks.callback_data import FAQCallback, CoworkingCallback, DateCallback, TimeCallback, RoomsCallback, \
-    EndRoomCallback, GroupReportCallback
+    EndRoomCallback, GroupReportCallback, CheckInSessionCallback
+from src.callbacks.dispatch import CallbackIndex
 from src.keyboards import keyboards_ru
 from src.lexicon import lexicon_ru
 from src.states.bot_states import ReportStates, AdminMailingState
 from typing import Callable, Dict, Awaitable, Any
 from src.backend.users_controller import BackendUsersController
 from src.backend.spaces_controller import SpacesApiController
+from src.database import db_functions
+from src.database.database import async_session_maker
+from src.filters.filters import RoleRouter
+from src.services.broadcast import start_mailing, spawn
+from src.services.check_in import check_in_reporter
+from src.services.check_in_tokens import check_in_sessions
+from src.services.loop_watchdog import loop_watchdog
 
 
-class AdminAccessMiddleware(BaseMiddleware):
-    async def __call__(
-            self,
-            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
-            event: TelegramObject,
-            data: Dict[str, Any]
-    ) -> Any:
-        # Получаем объект пользователя aiogram из данных события
-        event_user = data.get('event_from_user')
-        if not event_user:
-            # Событие без пользователя (например, опрос в канале), пропускаем
-            return await handler(event, data)
-
-        # Запрашиваем пользователя из нашего API
-        user_from_api = BackendUsersController.get_user_by_tg_id(event_user.id)
-
-        # ГЛАВНАЯ ЛОГИКА ФИЛЬТРАЦИИ
-        if user_from_api and user_from_api.role == 'admin':
-            # Если пользователь - студент, обогащаем данные и передаем управление дальше
-            data['user'] = user_from_api
-            return await handler(event, data)
-
-        raise CancelHandler()
-
-
-# filters.py
-
-
-# Предположим, ваш контроллер находится здесь
-# from a_folder.controllers import BackendUsersController
-
-class RoleFilter(BaseFilter):
-    def __init__(self, allowed_role: str):
-        self.allowed_role = allowed_role
-
-    async def __call__(self, event: Union[Message, CallbackQuery]) -> bool:
-        # Проверяем, есть ли вообще пользователь в событии
-        if not event.from_user:
-            return False
-        try:
-            # Делаем запрос в наше API прямо внутри фильтра
-            user_from_api = BackendUsersController.get_user_by_tg_id(
-                str(event.from_user.id))
-        except HTTPError:
-            return False
-        print(user_from_api)
-        # Если пользователь найден и его роль совпадает с разрешенной - фильтр пройден
-        if user_from_api and user_from_api.role == self.allowed_role:
-            return True
-
-        # Во всех остальных случаях - не пропускаем
-        return False
-
-
-router = Router()
-router.message.filter(RoleFilter("admin"))
-router.callback_query.filter(RoleFilter("admin"))
+router = RoleRouter("admin")
+# Все callback-хендлеры роутера выбираются по префиксу callback_data через индекс
+callbacks = CallbackIndex(router)
 
 
 @router.message(CommandStart())
@@ -95,57 +49,102 @@ async def process_start_for_admin(message: Message):
                          reply_markup=keyboards_ru.gen_start_admin_keyboard())
 
 
-@router.callback_query(F.data == "mailing")
+@callbacks("mailing")
 async def process_mailing_callback(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AdminMailingState.wait_message)
     await callback.message.edit_text(text=lexicon_ru.MAILING_TEXT, reply_markup=keyboards_ru.menu_keyboard)
     await callback.answer()
 
 
-@router.message(StateFilter(AdminMailingState.wait_message))
-async def process_mailing_message(message: Message):
-    users = BackendUsersController.get_users()
-    for user_model in users:
-        try:
-            await message.send_copy(chat_id=user_model.tgID)
-        except TelegramForbiddenError:
-            pass
-
-    await message.answer(text=lexicon_ru.SUCCESS_MAILING, reply_markup=keyboards_ru.menu_keyboard)
+async def get_mailing_audience() -> list[int]:
+    # Аудитория берется из локального зеркала пользователей, но только после успешной полной
+    # синхронизации: до нее в зеркале лишь те, кто успел обратиться к боту
+    async with async_session_maker() as session:
+        if await db_functions.get_sync_completed_at(session) is not None:
+            return await db_functions.get_user_ids(session)
+    users = await BackendUsersController.get_users()
+    return [user_model.tgID for user_model in users]
 
 
-@router.callback_query(F.data == "booking_room")
+@router.message(StateFilter(AdminMailingState.wait_message), flags={"throttling_cost": 5})
+async def process_mailing_message(message: Message, bot: Bot, state: FSMContext):
+    await state.clear()
+    # Ответ администратору сразу, рассылка идет в фоне и обновляет это сообщение
+    progress_message = await message.answer(text=lexicon_ru.SUCCESS_MAILING)
+    spawn(start_mailing(bot=bot, message=message, progress_message=progress_message,
+                        audience=get_mailing_audience()))
+
+
+@router.message(Command("stalls"))
+async def process_stalls_command(message: Message):
+    offenders = loop_watchdog.worst_offenders()
+    if not offenders:
+        await message.answer(text=lexicon_ru.LOOP_STALLS_EMPTY_TEXT)
+        return
+    # В сообщение попадают только последние кадры стека, чтобы уложиться в лимит Telegram
+    sites = [lexicon_ru.LOOP_STALL_SITE_TEXT.format(position=position, site=escape(offender.site),
+                                                    count=offender.count,
+                                                    total_ms=round(offender.total * 1000),
+                                                    worst_ms=round(offender.worst * 1000),
+                                                    stack=escape("\n".join(offender.stack[-3:])))
+             for position, offender in enumerate(offenders, start=1)]
+    await message.answer(text=lexicon_ru.LOOP_STALLS_TEXT.format(total=len(loop_watchdog.stalls),
+                                                                 threshold=round(loop_watchdog.threshold * 1000),
+                                                                 offenders="\n".join(sites)))
+
+
+@callbacks("booking_room", flags={"throttling_cost": 2})
 async def process_booking_room_callback(callback: CallbackQuery):
-    rooms = SpacesApiController.get_rooms()
+    rooms = await SpacesApiController.get_rooms()
     await callback.message.edit_text(text=lexicon_ru.BOOKING_ROOM_TEXT,
                                      reply_markup=keyboards_ru.gen_rooms_keyboard(rooms=rooms))
     await callback.answer()
 
 
-@router.callback_query(RoomsCallback.filter())
+@callbacks(RoomsCallback, flags={"throttling_cost": 3})
 async def process_rooms_callback(callback: CallbackQuery, callback_data: RoomsCallback):
-    SpacesApiController.update_room_booking(room_id=callback_data.room_id, is_booked=True,
-                                            booked_by=str(callback.from_user.id))
+    await SpacesApiController.update_room_booking(room_id=callback_data.room_id, is_booked=True,
+                                                  booked_by=str(callback.from_user.id))
     await callback.message.edit_text(text=lexicon_ru.SUCCESS_BOOKING_ROOM.format(id=callback_data.room_id),
                                      reply_markup=keyboards_ru.gen_booking_end_keyboard(room_id=callback_data.room_id))
     await callback.answer()
 
 
-@router.callback_query(EndRoomCallback.filter())
+@callbacks(EndRoomCallback, flags={"throttling_cost": 3})
 async def process_end_room_callback(callback: CallbackQuery, callback_data: EndRoomCallback):
-    SpacesApiController.update_room_booking(room_id=callback_data.room_id,
-                                            is_booked=False, booked_by="")
+    await SpacesApiController.update_room_booking(room_id=callback_data.room_id,
+                                                  is_booked=False, booked_by="")
     await callback.message.edit_text(text=lexicon_ru.END_ROOM_BOOKING_TEXT, reply_markup=keyboards_ru.menu_keyboard)
     await callback.answer()
 
 
-@router.callback_query(F.data == "admin_check_in")
-async def process_admin_check_in_callback(callback: CallbackQuery):
-    await callback.message.edit_text(text=lexicon_ru.CHECK_IN_ADMIN_TEXT, reply_markup=keyboards_ru.menu_keyboard)
+@callbacks("admin_check_in", flags={"throttling_cost": 2})
+async def process_admin_check_in_callback(callback: CallbackQuery, bot: Bot):
+    if not check_in_reporter.enabled:
+        # Отметки по токенам некуда передать (не задан CHECK_IN_REPORT_PATH): QR-код Verify Service
+        await callback.message.edit_text(text=lexicon_ru.CHECK_IN_ADMIN_TEXT, reply_markup=keyboards_ru.menu_keyboard)
+        await callback.answer()
+        return
+    # Сессия сама отправляет QR-код и заменяет его при каждой ротации токена
+    check_in_sessions.open(bot=bot, chat_id=callback.message.chat.id, issuer_id=callback.from_user.id)
+    await callback.answer()
+
+
+@callbacks(CheckInSessionCallback)
+async def process_check_in_session_callback(callback: CallbackQuery, callback_data: CheckInSessionCallback,
+                                            bot: Bot):
+    if callback_data.action == "show":
+        await check_in_sessions.resend(bot=bot, session_id=callback_data.session_id)
+        await callback.answer()
+        return
+    check_in_sessions.close(callback_data.session_id)
+    await callback.message.delete()
+    await callback.message.answer(text=lexicon_ru.CHECK_IN_SESSION_CLOSED_TEXT,
+                                  reply_markup=keyboards_ru.menu_keyboard)
     await callback.answer()
 
 
-@router.callback_query(F.data == "menu")
+@callbacks("menu")
 async def process_menu_callback(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text(text=lexicon_ru.START_ADMIN_MESSAGE_TEXT,
@@ -153,7 +152,7 @@ async def process_menu_callback(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.callback_query(GroupReportCallback.filter())
+@callbacks(GroupReportCallback, flags={"throttling_cost": 2})
 async def process_group_report_callback(callback: CallbackQuery, callback_data: GroupReportCallback, bot: Bot):
     await bot.send_message(chat_id=callback_data.user_id, text=lexicon_ru.REPORT_GROUP_PROCESSED_TEXT,
                            reply_markup=keyboards_ru.menu_keyboard)
@@ -13,28 +13,27 @@ from aiogram.fsm.context import FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from src.backend.users_controller import BackendUsersController
-from src.backend.qr_controller import VerifyApiController
+from src.services.registration import user_registrar
 
+from src.callbacks.dispatch import CallbackIndex
 from src.keyboards import keyboards_ru
+from src.services.check_in import check_in_by_deeplink
 from src.lexicon import lexicon_ru
 
 router = Router()
+# Все callback-хендлеры роутера выбираются по префиксу callback_data через индекс
+callbacks = CallbackIndex(router)
 
 
-@router.message(CommandStart(deep_link=True, magic=F.args))
-async def process_start_with_deeplink(message: Message, command: CommandObject):
-    deeplink_param = command.args
-    verify_result = VerifyApiController.verify_uuid(uuid=deeplink_param)
-    if verify_result.valid:
-        await message.answer(text=lexicon_ru.SUCCESS_CHECK_IN)
-    else:
-        await message.answer(text=lexicon_ru.UNSUCCESS_CHECK_IN)
+@router.message(CommandStart(deep_link=True, magic=F.args), flags={"throttling_cost": 2})
+async def process_start_with_deeplink(message: Message, command: CommandObject, bot: Bot):
+    await check_in_by_deeplink(message=message, bot=bot, payload=command.args)
 
 
 @router.message(CommandStart())
 async def show_menu(message: Message, state: FSMContext):
-    BackendUsersController.create_user(
-        tgID=str(message.from_user.id), language="ru")
+    # Регистрация идет в фоне и только для еще не известных боту пользователей
+    user_registrar.register(tg_id=message.from_user.id, language="ru")
     await state.clear()
     await message.answer(text=lexicon_ru.START_MESSAGE_TEXT,
                          reply_markup=keyboards_ru.gen_start_keyboard())
@@ -45,7 +44,7 @@ async def process_help(message: Message):
     await message.answer(text=lexicon_ru.HELP_MESSAGE_TEXT)
 
 
-@router.callback_query(F.data == "menu")
+@callbacks("menu")
 async def process_menu_callback(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.message.edit_text(text=lexicon_ru.START_MESSAGE_TEXT,
@@ -1,9 +1,10 @@
 from datetime import datetime, timedelta, date
 import asyncio
+import logging
 
 from aiogram import Router, Bot, F, BaseMiddleware
 from aiogram.dispatcher.event.bases import CancelHandler
-from aiogram.exceptions import TelegramUnauthorizedError
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramUnauthorizedError
 from aiogram.filters.callback_data import CallbackData
 from aiogram.types import Message, TelegramObject
 from aiogram.types import ChatMemberUpdated, Chat, CallbackQuery
@@ -14,20 +15,29 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import State, default_state, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.token import TokenValidationError
-from requests import HTTPError
+from aiohttp import ClientError, ClientResponseError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from src.backend.qr_controller import VerifyApiController
 from src.callbacks.callback_data import FAQCallback, CoworkingCallback, DateCallback, TimeCallback, FAQCallback2
+from src.callbacks.dispatch import CallbackIndex
 from src.keyboards import keyboards_ru
+from src.services.broadcast import spawn
+from src.services.check_in import check_in_by_deeplink
+from src.services.send_scheduler import bulk_sends
 from src.lexicon import lexicon_ru
 from src.states.bot_states import ReportStates
 from typing import Callable, Dict, Awaitable, Any, Union
 from src.backend.users_controller import BackendUsersController
 from src.backend.spaces_controller import SpacesApiController
+from src.backend.slot_index import coworking_slots
+from src.filters.filters import RoleRouter
 
 ADMIN_GROUP_ID = -4904031171
+# Попытки переслать заявку в группу администраторов, прежде чем сообщить студенту об ошибке
+REPORT_FORWARD_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
 
 
 def get_next_seven_days():
@@ -58,28 +68,6 @@ def get_next_seven_days():
     return date_list
 
 
-class RoleFilter(BaseFilter):
-    def __init__(self, allowed_role: str):
-        self.allowed_role = allowed_role
-
-    async def __call__(self, event: Union[Message, CallbackQuery]) -> bool:
-        # Проверяем, есть ли вообще пользователь в событии
-        if not event.from_user:
-            return False
-        try:
-            # Делаем запрос в наше API прямо внутри фильтра
-            user_from_api = BackendUsersController.get_user_by_tg_id(
-                str(event.from_user.id))
-        except HTTPError:
-            return False
-        # Если пользователь найден и его роль совпадает с разрешенной - фильтр пройден
-        if user_from_api and user_from_api.role == self.allowed_role:
-            return True
-
-        # Во всех остальных случаях - не пропускаем
-        return False
-
-
 def string_to_date_strptime(date_string: str) -> date:
     """
     Преобразует строку с датой в формате 'ГГГГ-ММ-ДД'
@@ -101,19 +89,47 @@ def string_to_date_strptime(date_string: str) -> date:
     return datetime_object.date()
 
 
-router = Router()
-router.message.filter(RoleFilter("student"))
-router.callback_query.filter(RoleFilter("student"))
+async def refresh_coworking_slots(cowo_id: str) -> None:
+    """Обновить снимок слотов, если он устарел или в нем нет коворкинга; при ошибке остается старый"""
+    if not coworking_slots.is_fresh() or not coworking_slots.has(cowo_id):
+        try:
+            await SpacesApiController.get_coworkings()
+        except ClientError:
+            pass
 
 
-@router.message(CommandStart(deep_link=True, magic=F.args))
-async def process_start_with_deeplink(message: Message, command: CommandObject):
-    deeplink_param = command.args
-    verify_result = VerifyApiController.verify_uuid(uuid=deeplink_param)
-    if verify_result.valid:
-        await message.answer(text=lexicon_ru.SUCCESS_CHECK_IN)
-    else:
-        await message.answer(text=lexicon_ru.UNSUCCESS_CHECK_IN)
+async def get_week_available_times(cowo_id: str, dates: list[str]) -> dict[str, list[str]]:
+    """
+    Возвращает свободное время коворкинга на все даты: {дата: список свободного времени}.
+
+    Время считается локально по индексу слотов из снимка get_coworkings(). Если снимок
+    устарел, он обновляется одним запросом. Только когда коворкинга нет в снимке,
+    время запрашивается по всем датам параллельно; даты с ошибкой запроса в словарь не попадают.
+    """
+    await refresh_coworking_slots(cowo_id)
+    if coworking_slots.has(cowo_id):
+        return {cowo_date: coworking_slots.available_times(cowo_id, string_to_date_strptime(date_string=cowo_date))
+                for cowo_date in dates}
+
+    responses = await asyncio.gather(
+        *(SpacesApiController.get_cached_available_time(coworking_id=cowo_id,
+                                                         date_param=string_to_date_strptime(date_string=cowo_date))
+          for cowo_date in dates),
+        return_exceptions=True
+    )
+    return {cowo_date: response.available_times
+            for cowo_date, response in zip(dates, responses)
+            if not isinstance(response, Exception)}
+
+
+router = RoleRouter("student")
+# Все callback-хендлеры роутера выбираются по префиксу callback_data через индекс
+callbacks = CallbackIndex(router)
+
+
+@router.message(CommandStart(deep_link=True, magic=F.args), flags={"throttling_cost": 2})
+async def process_start_with_deeplink(message: Message, command: CommandObject, bot: Bot):
+    await check_in_by_deeplink(message=message, bot=bot, payload=command.args)
 
 
 @router.message(CommandStart())
@@ -123,29 +139,29 @@ async def show_menu(message: Message, state: FSMContext):
                          reply_markup=keyboards_ru.gen_start_keyboard())
 
 
-@router.callback_query(F.data == "coworking")
+@callbacks("coworking", flags={"throttling_cost": 2})
 async def process_coworking_callback(callback: CallbackQuery):
-    coworkings = SpacesApiController.get_coworkings()
+    coworkings = await SpacesApiController.get_coworkings()
     await callback.message.edit_text(text=lexicon_ru.COWORKING_TEXT,
                                      reply_markup=keyboards_ru.gen_coworking_keyboard(coworkings=coworkings))
     await callback.answer()
 
 
-@router.callback_query(F.data == "nvk_links")
+@callbacks("nvk_links")
 async def process_nvk_links_callback(callback: CallbackQuery):
     await callback.message.edit_text(text=lexicon_ru.NVK_LINKS_TEXT,
                                      reply_markup=keyboards_ru.gen_nvk_links_keyboard())
     await callback.answer()
 
 
-@router.callback_query(F.data == "check_in")
+@callbacks("check_in")
 async def process_check_in_callback(callback: CallbackQuery):
     await callback.message.edit_text(text=lexicon_ru.CHECK_IN_TEXT,
                                      reply_markup=keyboards_ru.gen_check_in_keyboard())
     await callback.answer()
 
 
-@router.callback_query(F.data == "report")
+@callbacks("report")
 async def process_report_callback(callback: CallbackQuery, state: FSMContext):
     await state.set_state(ReportStates.wait_message_with_photo)
     await callback.message.edit_text(text=lexicon_ru.REPORT_TEXT,
@@ -153,30 +169,60 @@ async def process_report_callback(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.message(F.photo, StateFilter(ReportStates.wait_message_with_photo))
+@router.message(F.photo, StateFilter(ReportStates.wait_message_with_photo), flags={"throttling_cost": 3})
 async def process_report_photo(message: Message, bot: Bot):
     # Тут можно добавить функцию обработки(то есть админ нажимает, что репорт обработан и пользователю приходит уведомление.)
-    await message.send_copy(chat_id=ADMIN_GROUP_ID)
-    await bot.send_message(chat_id=ADMIN_GROUP_ID, text=lexicon_ru.REPORT_GROUP_TEXT,
-                           reply_markup=keyboards_ru.gen_report_group_keyboard(user_id=message.from_user.id))
-    await message.answer(text="Успешно, твоя заявка отправлена!", reply_markup=keyboards_ru.menu_keyboard)
-
-
-@router.callback_query(F.data == "FAQ")
+    # Пересылка в группу администраторов ждет лимита группы, поэтому идет в фоне и не держит воркер апдейтов.
+    # Об успехе студент узнает, только когда группа приняла заявку
+    pending_message = await message.answer(text=lexicon_ru.REPORT_SENDING_TEXT)
+    spawn(forward_report(message, bot, pending_message))
+
+
+async def forward_report(message: Message, bot: Bot, pending_message: Message) -> None:
+    try:
+        with bulk_sends():
+            await send_with_retries(lambda: message.send_copy(chat_id=ADMIN_GROUP_ID))
+            await send_with_retries(lambda: bot.send_message(
+                chat_id=ADMIN_GROUP_ID, text=lexicon_ru.REPORT_GROUP_TEXT,
+                reply_markup=keyboards_ru.gen_report_group_keyboard(user_id=message.from_user.id)))
+    except TelegramAPIError:
+        logger.exception("Не удалось переслать заявку студента %s в группу администраторов", message.from_user.id)
+        await pending_message.edit_text(text=lexicon_ru.REPORT_FAILED_TEXT, reply_markup=keyboards_ru.menu_keyboard)
+        return
+    await pending_message.edit_text(text=lexicon_ru.REPORT_SENT_TEXT, reply_markup=keyboards_ru.menu_keyboard)
+
+
+async def send_with_retries(send: Callable[[], Awaitable[Any]], attempts: int = REPORT_FORWARD_ATTEMPTS) -> Any:
+    """Повторять отправку при flood wait и сетевых ошибках; остальные ошибки Bot API - сразу наружу"""
+    for attempt in range(1, attempts + 1):
+        try:
+            return await send()
+        except TelegramRetryAfter as error:
+            # send_scheduler уже повторил отправку и не дождался конца flood wait
+            if attempt == attempts:
+                raise
+            await asyncio.sleep(error.retry_after)
+        except TelegramNetworkError:
+            if attempt == attempts:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+
+@callbacks("FAQ")
 async def process_faq_callback(callback: CallbackQuery):
     await callback.message.edit_text(text=lexicon_ru.FAQ_TEXT,
                                      reply_markup=keyboards_ru.gen_faq_keyboard())
     await callback.answer()
 
 
-@router.callback_query(FAQCallback.filter())
+@callbacks(FAQCallback)
 async def process_faq_2_callback(callback: CallbackQuery, callback_data: FAQCallback):
     await callback.message.edit_text(text=lexicon_ru.FAQ_TEXT,
                                      reply_markup=keyboards_ru.gen_faq_keyboard_2(first_callback=callback_data.faq))
     await callback.answer()
 
 
-@router.callback_query(FAQCallback2.filter())
+@callbacks(FAQCallback2)
 async def process_faq_3_callback(callback: CallbackQuery, callback_data: FAQCallback2):
     ans = lexicon_ru.SERVICE_FAQ_DICT_2.get(callback_data.faq)
     if not ans:
@@ -185,36 +231,78 @@ async def process_faq_3_callback(callback: CallbackQuery, callback_data: FAQCall
     ans
 
 
-@router.callback_query(CoworkingCallback.filter())
+@callbacks(CoworkingCallback, flags={"throttling_cost": 2})
 async def process_coworking_callback_2(callback: CallbackQuery, callback_data: CoworkingCallback, state: FSMContext):
-    await state.update_data(cowo_id=callback_data.id)
-    await callback.message.edit_text(text=lexicon_ru.CHOICE_DATE_TEXT,
-                                     reply_markup=keyboards_ru.gen_coworking_keyboard_2(dates=get_next_seven_days()))
+    dates = get_next_seven_days()
+    week_times = await get_week_available_times(cowo_id=callback_data.id, dates=dates)
+    # Полностью занятые дни скрываем, дни с ошибкой запроса оставляем - время для них запросим при выборе
+    free_dates = [cowo_date for cowo_date in dates if week_times.get(cowo_date, True)]
+    await state.update_data(cowo_id=callback_data.id, cowo_times=week_times)
+    text = lexicon_ru.CHOICE_DATE_TEXT if free_dates else lexicon_ru.NO_FREE_DATES_TEXT
+    await callback.message.edit_text(text=text,
+                                     reply_markup=keyboards_ru.gen_coworking_keyboard_2(dates=free_dates))
     await callback.answer()
 
 
-@router.callback_query(DateCallback.filter())
+@callbacks(DateCallback)
 async def process_date_callback(callback: CallbackQuery, callback_data: DateCallback, state: FSMContext):
     data = await state.get_data()
     cowo_id = data.get("cowo_id")
     cowo_date = callback_data.date
     await state.update_data(cowo_date=cowo_date)
-    coworking_response = SpacesApiController.get_coworking_available_time(coworking_id=cowo_id,
-                                                                          date_param=string_to_date_strptime(date_string=cowo_date))
+    booking_date = string_to_date_strptime(date_string=cowo_date)
+    # Время считается по локальному индексу слотов или берется из полученного при выборе коворкинга,
+    # запрос к API нужен только для дней, по которым при выборе была ошибка
+    await refresh_coworking_slots(cowo_id)
+    if coworking_slots.has(cowo_id):
+        times = coworking_slots.available_times(cowo_id, booking_date)
+    else:
+        times = data.get("cowo_times", {}).get(cowo_date)
+    if times is None:
+        coworking_response = await SpacesApiController.get_cached_available_time(coworking_id=cowo_id,
+                                                                                 date_param=booking_date)
+        times = coworking_response.available_times
     await callback.message.edit_text(text=lexicon_ru.CHOICE_TIME_TEXT,
-                                     reply_markup=keyboards_ru.gen_coworking_keyboard_3(times=coworking_response.available_times))
+                                     reply_markup=keyboards_ru.gen_coworking_keyboard_3(times=times))
+    await callback.answer()
+
+
+async def show_time_already_booked(callback: CallbackQuery, state: FSMContext, cowo_date: str,
+                                   times: list[str]) -> None:
+    data = await state.get_data()
+    cowo_times = data.get("cowo_times", {})
+    cowo_times[cowo_date] = times
+    await state.update_data(cowo_times=cowo_times)
+    await callback.message.edit_text(text=lexicon_ru.TIME_ALREADY_BOOKED_TEXT,
+                                     reply_markup=keyboards_ru.gen_coworking_keyboard_3(times=times))
     await callback.answer()
 
 
-@router.callback_query(TimeCallback.filter())
+@callbacks(TimeCallback, flags={"throttling_cost": 3})
 async def process_time_callback(callback: CallbackQuery, callback_data: TimeCallback, state: FSMContext):
     data = await state.get_data()
     cowo_id = data.get("cowo_id")
     cowo_date = data.get("cowo_date")
     cowo_time = callback_data.time.replace(".", ":")
     time_to_booking = f"{cowo_date} {cowo_time}"
-    SpacesApiController.add_coworking_booking_time(
-        coworking_id=cowo_id, time=time_to_booking)
+    booking_date = string_to_date_strptime(date_string=cowo_date)
+    # Время для выбора считалось локально, поэтому перед бронированием сверяемся с сервером
+    coworking_response = await SpacesApiController.get_coworking_available_time(coworking_id=cowo_id,
+                                                                                date_param=booking_date)
+    if cowo_time not in coworking_response.available_times:
+        await show_time_already_booked(callback, state, cowo_date, coworking_response.available_times)
+        return
+    try:
+        await SpacesApiController.add_coworking_booking_time(
+            coworking_id=cowo_id, time=time_to_booking)
+    except ClientResponseError as error:
+        if error.status != 409:
+            raise
+        # Слот заняли между проверкой и бронированием; контроллер уже сбросил кэш доступности
+        coworking_response = await SpacesApiController.get_coworking_available_time(coworking_id=cowo_id,
+                                                                                    date_param=booking_date)
+        await show_time_already_booked(callback, state, cowo_date, coworking_response.available_times)
+        return
     await callback.message.edit_text(text=lexicon_ru.SUCCESS_BOOKING.format(cw_id=cowo_id, time=time_to_booking),
                                      reply_markup=keyboards_ru.menu_keyboard)
     await callback.answer()
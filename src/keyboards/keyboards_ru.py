@@ -1,120 +1,191 @@
+from functools import lru_cache
+
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from src.backend.spaces_controller import CoworkingModel, RoomModel
 from src.callbacks.callback_data import FAQCallback, CoworkingCallback, DateCallback, TimeCallback, RoomsCallback, \
-    EndRoomCallback, GroupReportCallback, FAQCallback2
+    EndRoomCallback, GroupReportCallback, FAQCallback2, CheckInSessionCallback
 from src.lexicon import lexicon_ru
 from src.callbacks import callback_data
 
+
+def _freeze(rows: list[list[InlineKeyboardButton]]) -> InlineKeyboardMarkup:
+    """Клавиатура с рядами-кортежами: один экземпляр отдается всем хендлерам, добавить в него ряд нельзя"""
+    # model_construct без валидации: pydantic превратил бы кортежи обратно в списки
+    return InlineKeyboardMarkup.model_construct(inline_keyboard=tuple(tuple(row) for row in rows))
+
+
 menu_btn = InlineKeyboardButton(text=lexicon_ru.MENU_BTN_TEXT,
                                 callback_data=lexicon_ru.MENU_BTN_CALLBACK)
 
-menu_keyboard = InlineKeyboardMarkup(inline_keyboard=[[menu_btn]])
+menu_keyboard = _freeze([[menu_btn]])
 
 
-def gen_start_keyboard():
+# Статические клавиатуры зависят только от lexicon_ru и собираются один раз при импорте модуля
+
+def _build_start_keyboard():
     builder = InlineKeyboardBuilder()
     for btn_text, btn_callback in lexicon_ru.START_KEYBOARD_DICT.items():
         builder.row(InlineKeyboardButton(text=btn_text,
                                          callback_data=btn_callback))
-    return builder.as_markup()
+    return _freeze(builder.export())
 
 
-def gen_coworking_keyboard(coworkings: list[CoworkingModel]):
+def _build_menu_only_keyboard():
     builder = InlineKeyboardBuilder()
-    for coworking_model in coworkings:
-        builder.row(InlineKeyboardButton(text=f"Коворкинг номер {coworking_model.id}",
-                                         callback_data=CoworkingCallback(id=coworking_model.id).pack()))
+    # Все остальные кнопки добавляются тут
     builder.row(menu_btn)
-    return builder.as_markup()
+    return _freeze(builder.export())
 
 
-def gen_coworking_keyboard_2(dates: list[str]):
+def _build_faq_keyboard():
     builder = InlineKeyboardBuilder()
-    for date in dates:
-        builder.row(InlineKeyboardButton(text=date,
-                                         callback_data=DateCallback(date=date).pack()))
+    for btn_text, btn_callback in lexicon_ru.FAQ_BTN_DICT.items():
+        builder.row(InlineKeyboardButton(text=btn_text,
+                                         callback_data=FAQCallback(faq=btn_callback).pack()))
     builder.row(menu_btn)
-    return builder.as_markup()
+    return _freeze(builder.export())
 
 
-def gen_coworking_keyboard_3(times: list[str]):
+def _build_faq_keyboard_2(chosen_dict: dict):
     builder = InlineKeyboardBuilder()
-    for time in times:
-        builder.row(InlineKeyboardButton(text=time,
-                                         callback_data=TimeCallback(time=time.replace(":", ".")).pack()))
-    builder.adjust(3)
+    for btn_text, btn_callback in chosen_dict.items():
+        builder.row(InlineKeyboardButton(text=btn_text,
+                                         callback_data=FAQCallback2(faq=btn_callback).pack()))
     builder.row(menu_btn)
-    return builder.as_markup()
+    return _freeze(builder.export())
 
-def gen_nvk_links_keyboard():
+
+def _build_start_admin_keyboard():
     builder = InlineKeyboardBuilder()
-    # Все остальные кнопки добавляются тут
-    builder.row(menu_btn)
-    return builder.as_markup()
+    for btn_text, btn_callback in lexicon_ru.START_ADMIN_KEYBOARD_DICT.items():
+        builder.row(InlineKeyboardButton(text=btn_text,
+                                         callback_data=btn_callback))
+    return _freeze(builder.export())
+
+
+start_keyboard = _build_start_keyboard()
+start_admin_keyboard = _build_start_admin_keyboard()
+nvk_links_keyboard = _build_menu_only_keyboard()
+check_in_keyboard = _build_menu_only_keyboard()
+report_keyboard = _build_menu_only_keyboard()
+faq_keyboard = _build_faq_keyboard()
+faq_keyboards_2 = {first_callback: _build_faq_keyboard_2(chosen_dict)
+                   for first_callback, chosen_dict in lexicon_ru.SERVICE_FAQ_DICT.items()}
+
+
+def gen_start_keyboard():
+    return start_keyboard
+
+
+def gen_nvk_links_keyboard():
+    return nvk_links_keyboard
 
 
 def gen_check_in_keyboard():
-    builder = InlineKeyboardBuilder()
-    # Все остальные кнопки добавляются тут
-    builder.row(menu_btn)
-    return builder.as_markup()
+    return check_in_keyboard
 
 
 def gen_report_keyboard():
-    builder = InlineKeyboardBuilder()
-    # Все остальные кнопки добавляются тут
-    builder.row(menu_btn)
-    return builder.as_markup()
+    return report_keyboard
 
 
 def gen_faq_keyboard():
+    return faq_keyboard
+
+
+def gen_faq_keyboard_2(first_callback: str):
+    return faq_keyboards_2.get(first_callback, menu_keyboard)
+
+
+def gen_start_admin_keyboard():
+    return start_admin_keyboard
+
+
+# Динамические клавиатуры кэшируются по кортежу входных данных
+
+def gen_coworking_keyboard(coworkings: list[CoworkingModel]):
+    return _coworking_keyboard(tuple(coworking_model.id for coworking_model in coworkings))
+
+
+@lru_cache(maxsize=64)
+def _coworking_keyboard(coworking_ids: tuple[str, ...]):
     builder = InlineKeyboardBuilder()
-    for btn_text, btn_callback in lexicon_ru.FAQ_BTN_DICT.items():
-        builder.row(InlineKeyboardButton(text=btn_text,
-                                         callback_data=FAQCallback(faq=btn_callback).pack()))
+    for coworking_id in coworking_ids:
+        builder.row(InlineKeyboardButton(text=f"Коворкинг номер {coworking_id}",
+                                         callback_data=CoworkingCallback(id=coworking_id).pack()))
     builder.row(menu_btn)
-    return builder.as_markup()
+    return _freeze(builder.export())
 
 
-def gen_faq_keyboard_2(first_callback: str):
-    chosen_dict = lexicon_ru.SERVICE_FAQ_DICT.get(first_callback)
+def gen_coworking_keyboard_2(dates: list[str]):
+    return _coworking_keyboard_2(tuple(dates))
+
+
+@lru_cache(maxsize=256)
+def _coworking_keyboard_2(dates: tuple[str, ...]):
     builder = InlineKeyboardBuilder()
-    for btn_text, btn_callback in chosen_dict.items():
-        builder.row(InlineKeyboardButton(text=btn_text,
-                                         callback_data=FAQCallback2(faq=btn_callback).pack()))
+    for date in dates:
+        builder.row(InlineKeyboardButton(text=date,
+                                         callback_data=DateCallback(date=date).pack()))
     builder.row(menu_btn)
-    return builder.as_markup()
+    return _freeze(builder.export())
 
 
-def gen_start_admin_keyboard():
+def gen_coworking_keyboard_3(times: list[str]):
+    return _coworking_keyboard_3(tuple(times))
+
+
+@lru_cache(maxsize=256)
+def _coworking_keyboard_3(times: tuple[str, ...]):
     builder = InlineKeyboardBuilder()
-    for btn_text, btn_callback in lexicon_ru.START_ADMIN_KEYBOARD_DICT.items():
-        builder.row(InlineKeyboardButton(text=btn_text,
-                                         callback_data=btn_callback))
-    return builder.as_markup()
+    for time in times:
+        builder.row(InlineKeyboardButton(text=time,
+                                         callback_data=TimeCallback(time=time.replace(":", ".")).pack()))
+    builder.adjust(3)
+    builder.row(menu_btn)
+    return _freeze(builder.export())
 
 
 def gen_rooms_keyboard(rooms: list[RoomModel]):
+    return _rooms_keyboard(tuple(room_model.id for room_model in rooms if not room_model.is_booked))
+
+
+@lru_cache(maxsize=64)
+def _rooms_keyboard(free_room_ids: tuple[str, ...]):
     builder = InlineKeyboardBuilder()
-    for room_model in rooms:
-        if not room_model.is_booked:
-            builder.row(InlineKeyboardButton(text=f"Аудитория {room_model.id}",
-                                             callback_data=RoomsCallback(room_id=room_model.id).pack()))
+    for room_id in free_room_ids:
+        builder.row(InlineKeyboardButton(text=f"Аудитория {room_id}",
+                                         callback_data=RoomsCallback(room_id=room_id).pack()))
     builder.row(menu_btn)
-    return builder.as_markup()
+    return _freeze(builder.export())
 
 
+@lru_cache(maxsize=256)
 def gen_booking_end_keyboard(room_id):
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="Завершить бронирование",
                                      callback_data=EndRoomCallback(room_id=room_id).pack()))
-    return builder.as_markup()
+    return _freeze(builder.export())
 
 
+@lru_cache(maxsize=1024)
 def gen_report_group_keyboard(user_id: int):
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text=lexicon_ru.REPORT_GROUP_BTN,
                                      callback_data=GroupReportCallback(user_id=user_id).pack()))
-    return builder.as_markup()
+    return _freeze(builder.export())
+
+
+@lru_cache(maxsize=256)
+def gen_check_in_session_keyboard(session_id: int):
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text=lexicon_ru.CHECK_IN_SESSION_SHOW_BTN,
+                                     callback_data=CheckInSessionCallback(action="show",
+                                                                          session_id=session_id).pack()))
+    builder.row(InlineKeyboardButton(text=lexicon_ru.CHECK_IN_SESSION_STOP_BTN,
+                                     callback_data=CheckInSessionCallback(action="stop",
+                                                                          session_id=session_id).pack()))
+    builder.row(menu_btn)
+    return _freeze(builder.export())
@@ -58,6 +58,14 @@ REPORT_TEXT = """<b>⚠️ Что-то сломалось? Я помогу!</b>
 <i>Важно: в комментарии обязательно укажи место(этаж, аудитория), в котором обнаружена неисправность.</i>
 """
 
+REPORT_SENDING_TEXT = """⏳ Отправляем заявку…
+"""
+
+REPORT_SENT_TEXT = "Успешно, твоя заявка отправлена!"
+
+REPORT_FAILED_TEXT = """❌ Не удалось отправить заявку. Пожалуйста, отправь фото с комментарием еще раз чуть позже.
+"""
+
 REPORT_GROUP_TEXT = """<b>🔔 Уведомление о неисправности</b>
 
 Если заявка была обработана, пожалуйста, нажмите на кнопку ниже
@@ -142,10 +150,20 @@ CHOICE_DATE_TEXT = """📅 Отлично! Теперь выберите дат
 """
 
 
+NO_FREE_DATES_TEXT = """😔 К сожалению, в этом коворкинге нет свободного времени на ближайшие 7 дней.
+
+Попробуйте выбрать другой коворкинг.
+"""
+
+
 CHOICE_TIME_TEXT = """⏰ Супер! Остался последний шаг. Выберите удобное время из доступных вариантов ниже:
 """
 
 
+TIME_ALREADY_BOOKED_TEXT = """😔 Упс, это время только что заняли. Выберите другое время из доступных вариантов ниже:
+"""
+
+
 START_ADMIN_MESSAGE_TEXT = """👋 Здравствуйте! Вы вошли в панель преподавателя/администратора нового кампуса ИРИТ-РТФ. 🎓
 
 Здесь вы можете управлять бронированиями аудиторий, делать рассылки и отмечать посещаемость.
@@ -179,6 +197,49 @@ SUCCESS_MAILING = """🚀 Рассылка успешно отправлена!
 """
 
 
+MAILING_PROGRESS_TEXT = """🚀 Рассылка идет: {processed} из {total}
+
+✅ Доставлено: {delivered}
+🚫 Бот заблокирован: {blocked}
+⚠️ Ошибки: {failed}
+"""
+
+
+MAILING_DONE_TEXT = """✅ Рассылка завершена! Обработано {processed} из {total} получателей.
+
+📬 Доставлено: {delivered}
+🚫 Бот заблокирован: {blocked}
+⚠️ Ошибки: {failed}
+"""
+
+
+MAILING_STOPPED_TEXT = """❌ Рассылка остановлена из-за ошибки. Обработано {processed} из {total} получателей.
+
+📬 Доставлено: {delivered}
+🚫 Бот заблокирован: {blocked}
+⚠️ Ошибки: {failed}
+"""
+
+
+MAILING_FAILED_TEXT = """❌ Не удалось получить список пользователей для рассылки. Попробуйте ещё раз позже.
+"""
+
+
+LOOP_STALLS_TEXT = """<b>🐢 Блокировки event loop</b>
+Всего зафиксировано: {total}, порог: {threshold} мс
+
+{offenders}
+"""
+
+LOOP_STALL_SITE_TEXT = """<b>{position}. {site}</b>
+Раз: {count}, суммарно: {total_ms} мс, максимум: {worst_ms} мс
+<pre>{stack}</pre>
+"""
+
+LOOP_STALLS_EMPTY_TEXT = """✅ Блокировок event loop не зафиксировано.
+"""
+
+
 END_ROOM_BOOKING_TEXT = """✅ Готово! Бронирование аудитории завершено. Спасибо, что освободили её для других! 👋
 """
 
@@ -198,6 +259,44 @@ UNSUCCESS_CHECK_IN = """❌ Ошибка сканирования. Похоже,
 Пожалуйста, попробуйте отсканировать его ещё раз. 🔄
 """
 
+CHECK_IN_PENDING_TEXT = """⏳ Проверяем QR-код…
+"""
+
+CHECK_IN_BUSY_TEXT = """⏳ Сейчас отмечается слишком много студентов. Отсканируйте QR-код ещё раз через несколько секунд.
+"""
+
+CHECK_IN_ERROR_TEXT = """⚠️ Не удалось проверить QR-код: сервис отметок недоступен. Попробуйте отсканировать его ещё раз.
+"""
+
+CHECK_IN_QUEUED_TEXT = """🕓 Сервис отметок временно недоступен, но ваше сканирование сохранено.
+Мы проверим QR-код, как только сервис заработает, и пришлём результат сюда.
+"""
+
+CHECK_IN_CONFIRMED_TEXT = """✅ Отметка от {scanned_at} подтверждена: вы отмечены как присутствующий на занятии! 🎓
+"""
+
+CHECK_IN_REJECTED_TEXT = """❌ Отметка от {scanned_at} не подтверждена: QR-код оказался недействительным.
+Если вы были на занятии, обратитесь к преподавателю.
+"""
+
+CHECK_IN_EXPIRED_TEXT = """⌛ Этот QR-код уже сменился. Отсканируйте код, который сейчас показан на экране.
+"""
+
+CHECK_IN_REPLAY_TEXT = """✅ Вы уже отмечены на этом занятии.
+"""
+
+CHECK_IN_SESSION_TEXT = """📝 Отметка студентов открыта
+
+Выведите этот QR-код на проектор или экран в аудитории: студенты сканируют его и отмечаются в боте (<a href="{link}">ссылка</a>).
+🔄 Код меняется каждые {rotation} сек., старый переслать отсутствующим не получится.
+"""
+
+CHECK_IN_SESSION_CLOSED_TEXT = """✅ Отметка студентов завершена.
+"""
+
+CHECK_IN_SESSION_SHOW_BTN = "🔁 Показать код ещё раз"
+CHECK_IN_SESSION_STOP_BTN = "⏹ Завершить отметку"
+
 
 NEXT_TIME_ANSWER_TEXT = """В ближайшее время здесь появится ответ на выбранный тобой вопрос.
 """
@@ -1,14 +1,63 @@
 import asyncio
-from typing import Callable, Dict, Any, Awaitable
+import logging
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Awaitable, Optional
 from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.dispatcher.event.bases import CancelHandler
 from aiogram.types import TelegramObject, CallbackQuery, Message
-from sqlalchemy.ext.asyncio import async_sessionmaker
-from cachetools import TTLCache
+from aiohttp import ClientError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from src.backend.users_controller import BackendUsersController
+
+logger = logging.getLogger(__name__)
+
+
+class LazySession:
+    """Прокси AsyncSession: сессия создается при первом обращении к ней из хендлера
+
+    Проксируются только атрибуты сессии (execute, add, commit, begin и т.д.).
+    Сам прокси не является AsyncSession: isinstance(session, AsyncSession) ложно,
+    а async with session не поддерживается - жизненным циклом сессии управляет DBMiddleware.
+    """
+
+    __slots__ = ("_session_maker", "_session")
+
+    def __init__(self, session_maker: async_sessionmaker):
+        self._session_maker = session_maker
+        self._session: Optional[AsyncSession] = None
+
+    @property
+    def used(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name: str) -> Any:
+        if self._session is None:
+            self._session = self._session_maker()
+        return getattr(self._session, name)
+
+    async def finish(self, commit: bool) -> None:
+        """Зафиксировать (или откатить) и закрыть сессию, если она создавалась"""
+        if self._session is None:
+            return
+        try:
+            if commit:
+                await self._session.commit()
+            else:
+                await self._session.rollback()
+        finally:
+            await self._session.close()
 
 
 class DBMiddleware(BaseMiddleware):
     def __init__(self, session_maker: async_sessionmaker):
         self.session_maker = session_maker
+        # Сколько апдейтов прошло через middleware и скольким из них реально понадобилась БД
+        self.updates_total = 0
+        self.updates_with_db = 0
 
     async def __call__(
         self,
@@ -16,18 +65,93 @@ class DBMiddleware(BaseMiddleware):
         event: TelegramObject,
         data: Dict[str, Any]
     ):
-        async with self.session_maker() as session:
-            data['session'] = session
+        session = LazySession(self.session_maker)
+        data['session'] = session
+        self.updates_total += 1
 
+        try:
             result = await handler(event, data)
+        except BaseException:
+            await session.finish(commit=False)
+            raise
+        finally:
+            if session.used:
+                self.updates_with_db += 1
+
+        await session.finish(commit=True)
+        return result
+
+
+class TokenBuckets:
+    """Компактные token bucket по ключу пользователя
+
+    Токены и время последнего списания лежат в двух array('d') по номеру слота,
+    OrderedDict хранит ключ -> слот в порядке последнего обращения. Ведро, простоявшее
+    дольше времени полного восполнения, ничем не отличается от нового, поэтому такие
+    ведра удаляются с начала очереди за O(1) на каждое обращение.
+    """
+
+    __slots__ = ("capacity", "rate", "_full_after", "_slots", "_tokens", "_stamps", "_free")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._full_after = capacity / rate
+        self._slots: "OrderedDict[int, int]" = OrderedDict()
+        self._tokens = array('d')
+        self._stamps = array('d')
+        self._free: list = []
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def consume(self, key: int, cost: float, now: float) -> bool:
+        """Списать cost токенов, вернуть False, если токенов не хватает"""
+        self._expire(now)
+        slot = self._slots.get(key)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._tokens)
+                self._tokens.append(0.0)
+                self._stamps.append(0.0)
+            self._slots[key] = slot
+            tokens = self.capacity
+        else:
+            self._slots.move_to_end(key)
+            tokens = min(self.capacity, self._tokens[slot] + (now - self._stamps[slot]) * self.rate)
 
-            return result
+        cost = min(cost, self.capacity)
+        allowed = tokens >= cost
+        self._tokens[slot] = tokens - cost if allowed else tokens
+        self._stamps[slot] = now
+        return allowed
+
+    def _expire(self, now: float) -> None:
+        # Проверяем не больше двух самых старых ведер: амортизированно O(1)
+        for _ in range(2):
+            if not self._slots:
+                return
+            key = next(iter(self._slots))
+            slot = self._slots[key]
+            if now - self._stamps[slot] < self._full_after:
+                return
+            del self._slots[key]
+            self._free.append(slot)
 
 
 class ThrottlingMiddleware(BaseMiddleware):
+    """Троттлинг по token bucket: burst токенов на пользователя, восполнение rate токенов в секунду
+
+    Стоимость хендлера задается флагом throttling_cost (по умолчанию 1), поэтому
+    регистрируется на message/callback_query, где хендлер уже выбран.
+    """
 
-    def __init__(self, rate_limit: float = 0.7):
-        self.cache = TTLCache(maxsize=10_000, ttl=rate_limit)
+    def __init__(self, burst: float = 5, rate: float = 1.5):
+        self.buckets = TokenBuckets(capacity=burst, rate=rate)
+        self.allowed = 0
+        self.dropped = 0
 
     async def __call__(
         self,
@@ -39,10 +163,53 @@ class ThrottlingMiddleware(BaseMiddleware):
         if not user:
             return await handler(event, data)
 
-        if user.id in self.cache:
-            if event.callback_query:
-                await event.callback_query.answer()
+        cost = get_flag(data, 'throttling_cost', default=1)
+        if not self.buckets.consume(user.id, cost, time.monotonic()):
+            self.dropped += 1
+            if isinstance(event, CallbackQuery):
+                await event.answer()
             return
 
-        self.cache[user.id] = None
+        self.allowed += 1
+        return await handler(event, data)
+
+
+class RoleMiddleware(BaseMiddleware):
+    """Определяет роль пользователя один раз на апдейт и кладет ее в data['role']"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ):
+        role = None
+        user = data.get('event_from_user')
+        if user:
+            # Недоступный бэкенд не должен ронять апдейт: роль None не кэшируется,
+            # и следующий апдейт пользователя спросит ее снова
+            try:
+                role = await BackendUsersController.get_user_role(str(user.id))
+            except (ClientError, asyncio.TimeoutError) as e:
+                logger.warning("Не удалось получить роль пользователя %s: %r", user.id, e)
+                role = None
+        data['role'] = role
         return await handler(event, data)
+
+
+class AdminAccessMiddleware(BaseMiddleware):
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        # Событие без пользователя (например, опрос в канале), пропускаем
+        if not data.get('event_from_user'):
+            return await handler(event, data)
+
+        # Роль уже определена RoleMiddleware, повторный запрос в API не нужен
+        if data.get('role') == 'admin':
+            return await handler(event, data)
+
+        raise CancelHandler()
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Coroutine, Iterable, Iterator, List, Set, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import (TelegramAPIError, TelegramBadRequest, TelegramForbiddenError,
+                                TelegramNetworkError, TelegramRetryAfter)
+from aiogram.types import Message
+
+from src.database import db_functions
+from src.database.database import async_session_maker
+from src.database.models import Mailing, MailingStatus, RecipientStatus
+from src.keyboards import keyboards_ru
+from src.lexicon import lexicon_ru
+from src.services.send_scheduler import bulk_sends
+
+logger = logging.getLogger(__name__)
+
+DELIVERED = RecipientStatus.DELIVERED.value
+BLOCKED = RecipientStatus.BLOCKED.value
+FAILED = RecipientStatus.FAILED.value
+
+background_tasks: Set[asyncio.Task] = set()
+
+
+def spawn(coro: Coroutine) -> asyncio.Task:
+    """Запустить фоновую задачу, сохранив на нее ссылку до завершения"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_on_task_done)
+    return task
+
+
+def _on_task_done(task: asyncio.Task) -> None:
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Фоновая задача завершилась с ошибкой", exc_info=task.exception())
+
+
+@dataclass
+class MailingStats:
+    """Счетчики рассылки"""
+    total: int = 0
+    delivered: int = 0
+    blocked: int = 0
+    failed: int = 0
+
+    @property
+    def processed(self) -> int:
+        return self.delivered + self.blocked + self.failed
+
+
+class MailingJob:
+    """Фоновая рассылка копии сообщения администратора
+
+    Рассылка и статус доставки каждому получателю хранятся в БД (таблицы mailings и
+    mailing_recipients), поэтому после перезапуска бота рассылка продолжается с
+    неотправленных получателей. Статусы пишутся пачками: раз в progress_interval
+    секунд или по накоплении flush_batch_size результатов.
+
+    Отправки идут параллельно в concurrency воркеров как массовый трафик
+    (bulk_sends): лимиты Telegram и повторы после flood wait берет на себя
+    send_scheduler, ответы пользователям идут вперед рассылки.
+    Прогресс раз в progress_interval секунд выводится в сообщение администратора.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        mailing: Mailing,
+        concurrency: int = 10,
+        progress_interval: float = 3,
+        flush_batch_size: int = 500,
+        max_retries: int = 3
+    ):
+        self.bot = bot
+        self.mailing_id = mailing.id
+        self.from_chat_id = mailing.from_chat_id
+        self.message_id = mailing.message_id
+        self.progress_chat_id = mailing.progress_chat_id
+        self.progress_message_id = mailing.progress_message_id
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.flush_batch_size = flush_batch_size
+        self.max_retries = max_retries
+        self.stats = MailingStats()
+        self._results: List[Tuple[int, str]] = []
+        self._flush_lock = asyncio.Lock()
+
+    async def run(self) -> MailingStats:
+        """Разослать сообщение всем получателям, которым оно еще не отправлено"""
+        with bulk_sends():
+            return await self._run()
+
+    async def _run(self) -> MailingStats:
+        async with async_session_maker() as session:
+            recipients = await db_functions.get_pending_recipients(session, self.mailing_id)
+            counts = await db_functions.count_recipients_by_status(session, self.mailing_id)
+
+        self.stats = MailingStats(total=sum(counts.values()),
+                                  delivered=counts.get(DELIVERED, 0),
+                                  blocked=counts.get(BLOCKED, 0),
+                                  failed=counts.get(FAILED, 0))
+        queue = iter(recipients)
+        reporter = asyncio.create_task(self._report_progress())
+        status = MailingStatus.DONE
+        try:
+            # Ошибка одного воркера (например, статусы не записались в БД) отменяет остальных:
+            # рассылка не должна продолжаться без записи статусов
+            async with asyncio.TaskGroup() as workers:
+                for _ in range(self.concurrency):
+                    workers.create_task(self._worker(queue))
+        except Exception:
+            logger.exception("Рассылка %s остановлена из-за ошибки", self.mailing_id)
+            status = MailingStatus.FAILED
+        finally:
+            # Репортер мог быть прерван посреди _flush: дожидаемся его, чтобы последний flush
+            # шел уже после того, как он вернул свою пачку результатов в буфер
+            reporter.cancel()
+            try:
+                await reporter
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                logger.exception("Ошибка обновления прогресса рассылки %s", self.mailing_id)
+            await self._flush()
+
+        async with async_session_maker() as session:
+            await db_functions.finish_mailing(session, self.mailing_id, status)
+        text = lexicon_ru.MAILING_DONE_TEXT if status is MailingStatus.DONE else lexicon_ru.MAILING_STOPPED_TEXT
+        await self._edit_progress(text.format(**self._stats_kwargs()), final=True)
+        return self.stats
+
+    async def _worker(self, queue: Iterator[Tuple[int, str]]) -> None:
+        # Итератор общий для всех воркеров: next() синхронный, гонок в event loop нет
+        for position, chat_id in queue:
+            result = await self.send(chat_id)
+            setattr(self.stats, result, getattr(self.stats, result) + 1)
+            self._results.append((position, result))
+            if len(self._results) >= self.flush_batch_size:
+                await self._flush()
+
+    async def _flush(self) -> None:
+        async with self._flush_lock:
+            results, self._results = self._results, []
+            if not results:
+                return
+            try:
+                async with async_session_maker() as session:
+                    await db_functions.save_recipient_statuses(session, self.mailing_id, results)
+            except BaseException:
+                # Незаписанные статусы возвращаются в буфер и уйдут следующим flush
+                self._results = results + self._results
+                raise
+
+    async def send(self, chat_id: Union[int, str]) -> str:
+        """Отправить копию одному получателю, вернуть DELIVERED, BLOCKED или FAILED"""
+        for _ in range(self.max_retries):
+            try:
+                await self.bot.copy_message(chat_id=chat_id, from_chat_id=self.from_chat_id,
+                                            message_id=self.message_id)
+                return DELIVERED
+            except TelegramRetryAfter as error:
+                # send_scheduler не стал ждать такой долгий flood wait, рассылке спешить некуда
+                await asyncio.sleep(error.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED
+            except TelegramBadRequest:
+                return FAILED
+            except TelegramNetworkError:
+                continue
+            except TelegramAPIError:
+                return FAILED
+        return FAILED
+
+    async def _report_progress(self) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._flush()
+            await self._edit_progress(lexicon_ru.MAILING_PROGRESS_TEXT.format(**self._stats_kwargs()))
+
+    async def _edit_progress(self, text: str, final: bool = False) -> None:
+        await edit_progress(self.bot, self.progress_chat_id, self.progress_message_id, text, final)
+
+    def _stats_kwargs(self) -> dict:
+        return dict(total=self.stats.total, processed=self.stats.processed, delivered=self.stats.delivered,
+                    blocked=self.stats.blocked, failed=self.stats.failed)
+
+
+async def edit_progress(bot: Bot, chat_id: int, message_id: int, text: str, final: bool = False) -> None:
+    try:
+        await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id,
+                                    reply_markup=keyboards_ru.menu_keyboard if final else None)
+    except TelegramAPIError:
+        # "message is not modified" и прочие ошибки прогресса не должны останавливать рассылку
+        pass
+
+
+async def start_mailing(bot: Bot, message: Message, progress_message: Message,
+                        audience: Awaitable[Iterable[Union[int, str]]]) -> MailingStats:
+    """Получить аудиторию, сохранить рассылку в БД и запустить ее"""
+    try:
+        chat_ids = await audience
+    except Exception:
+        await edit_progress(bot, progress_message.chat.id, progress_message.message_id,
+                            lexicon_ru.MAILING_FAILED_TEXT, final=True)
+        raise
+
+    async with async_session_maker() as session:
+        mailing = await db_functions.create_mailing(session, from_chat_id=message.chat.id,
+                                                    message_id=message.message_id,
+                                                    progress_chat_id=progress_message.chat.id,
+                                                    progress_message_id=progress_message.message_id,
+                                                    chat_ids=chat_ids)
+    return await MailingJob(bot=bot, mailing=mailing).run()
+
+
+async def resume_mailings(bot: Bot) -> int:
+    """Продолжить рассылки, прерванные перезапуском бота. Возвращает их количество"""
+    async with async_session_maker() as session:
+        mailings = await db_functions.get_running_mailings(session)
+    for mailing in mailings:
+        spawn(MailingJob(bot=bot, mailing=mailing).run())
+    return len(mailings)
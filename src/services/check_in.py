@@ -0,0 +1,367 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Message
+from aiohttp import ClientError, ClientResponseError
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.backend.batch_loader import BatchWriter
+from src.backend.qr_controller import CheckInRecord, VerifyApiController
+from src.database import db_functions
+from src.database.database import async_session_maker
+from src.database.models import CheckInScan, ScanStatus
+from src.lexicon import lexicon_ru
+from src.services.check_in_tokens import TokenStatus, check_in_tokens
+from src.services.send_scheduler import bulk_sends
+
+logger = logging.getLogger(__name__)
+
+
+class CheckInJob(NamedTuple):
+    bot: Bot
+    chat_id: int
+    message_id: int
+    uuid: str
+    tg_id: int
+    scanned_at: float
+
+
+def is_service_failure(error: Exception) -> bool:
+    """Ошибка говорит о недоступности сервиса, а не о невалидном коде (4xx кроме 429)"""
+    if isinstance(error, ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (ClientError, asyncio.TimeoutError))
+
+
+class CheckInPipeline:
+    """Очередь отметок по QR-коду
+
+    Хендлер сразу отвечает "проверяем…" и ставит отметку в ограниченную очередь,
+    воркеры проверяют UUID и редактируют это сообщение результатом. Все студенты
+    сканируют один код, поэтому проверки одного UUID объединяются и кэшируются
+    (VerifyApiController.get_cached_verification). При заполненной очереди submit()
+    возвращает False и студент получает просьбу повторить. Если Verify Service
+    недоступен, отметка сохраняется в офлайн-очередь check_in_reconciler.
+    """
+
+    def __init__(self, workers: int = 16, queue_size: int = 1000):
+        self.workers = workers
+        self._queue: "asyncio.Queue[CheckInJob]" = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+
+    def configure(self, workers: int, queue_size: int) -> None:
+        self.workers = workers
+        if not self._tasks:
+            self._queue = asyncio.Queue(maxsize=queue_size)
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, bot: Bot, chat_id: int, message_id: int, uuid: str, tg_id: int, scanned_at: float) -> bool:
+        """Поставить отметку в очередь; False - очередь заполнена"""
+        try:
+            self._queue.put_nowait(CheckInJob(bot=bot, chat_id=chat_id, message_id=message_id, uuid=uuid,
+                                              tg_id=tg_id, scanned_at=scanned_at))
+        except asyncio.QueueFull:
+            return False
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._run()))
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            except Exception:
+                logger.exception("Не удалось обработать отметку %s", job.uuid)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job: CheckInJob) -> None:
+        text = await self.check(job)
+        try:
+            await job.bot.edit_message_text(text=text, chat_id=job.chat_id, message_id=job.message_id)
+        except TelegramAPIError as e:
+            logger.warning("Не удалось сообщить результат отметки в чат %s: %r", job.chat_id, e)
+
+    @staticmethod
+    async def check(job: CheckInJob) -> str:
+        """Проверить UUID и вернуть текст результата для студента"""
+        # Пока сервис недоступен, не ждем таймаута на каждой отметке
+        if check_in_reconciler.available:
+            try:
+                verify_result = await VerifyApiController.get_cached_verification(uuid=job.uuid)
+            except (ClientError, asyncio.TimeoutError) as e:
+                if not is_service_failure(e):
+                    return lexicon_ru.UNSUCCESS_CHECK_IN
+                check_in_reconciler.mark_unavailable(e)
+            else:
+                return lexicon_ru.SUCCESS_CHECK_IN if verify_result.valid else lexicon_ru.UNSUCCESS_CHECK_IN
+
+        try:
+            await check_in_reconciler.enqueue(job.bot, uuid=job.uuid, tg_id=job.tg_id, chat_id=job.chat_id,
+                                              scanned_at=job.scanned_at)
+        except SQLAlchemyError:
+            logger.exception("Не удалось сохранить отметку %s в офлайн-очередь", job.uuid)
+            return lexicon_ru.CHECK_IN_ERROR_TEXT
+        return lexicon_ru.CHECK_IN_QUEUED_TEXT
+
+    async def join(self, timeout: Optional[float] = None) -> None:
+        """Дождаться обработки уже принятых отметок (при остановке бота)"""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Остановка: в очереди отметок осталось %d", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+
+class CheckInReporter:
+    """Передача локально проверенных отметок в Verify Service через outbox в SQLite
+
+    Отметка по токену нигде больше не хранится, поэтому add() сначала записывает ее
+    в таблицу check_in_reports вместе с ключом защиты от повтора (отметки одного
+    прохода event loop - одной транзакцией через BatchWriter). Фоновая задача раз
+    в interval секунд отправляет самые старые строки пачками по batch_size и удаляет
+    их только после успешного ответа сервиса: при ошибке и после перезапуска они
+    уйдут при следующей попытке. Передача работает, только если у Verify Service
+    задан путь приема отметок (VerifyApiController.report_path).
+    """
+
+    def __init__(self, batch_size: int = 100, interval: float = 2.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._writer: BatchWriter[CheckInRecord] = BatchWriter(self._store)
+        self._worker: Optional[asyncio.Task] = None
+
+    def configure(self, batch_size: int, interval: float) -> None:
+        self.batch_size = batch_size
+        self.interval = interval
+
+    @property
+    def enabled(self) -> bool:
+        return VerifyApiController.report_path is not None
+
+    async def add(self, check_in: CheckInRecord) -> None:
+        """Сохранить отметку в outbox
+
+        Raises:
+            SQLAlchemyError: Отметку не удалось записать
+        """
+        await self._writer.write(check_in)
+        self.start()
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    @staticmethod
+    async def _store(check_ins: List[CheckInRecord]) -> None:
+        seen_at = time.time()
+        async with async_session_maker() as session:
+            await db_functions.add_check_in_reports(session, (
+                dict(session_id=check_in.session_id, issuer_id=check_in.issuer_id, tg_id=int(check_in.tgID),
+                     checked_at=check_in.checked_at, seen_at=seen_at) for check_in in check_ins))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if await self.flush():
+                    return
+            except SQLAlchemyError:
+                logger.exception("Не удалось прочитать outbox отметок, повторим позже")
+
+    async def flush(self) -> bool:
+        """Передать отметки из outbox; True - outbox пуст (или передача выключена), False - сервис недоступен"""
+        if not self.enabled:
+            return True
+        while True:
+            async with async_session_maker() as session:
+                reports = await db_functions.get_check_in_reports(session, limit=self.batch_size)
+            if not reports:
+                return True
+            batch = [CheckInRecord(session_id=report.session_id, issuer_id=report.issuer_id,
+                                   tgID=str(report.tg_id), checked_at=report.checked_at) for report in reports]
+            try:
+                await VerifyApiController.report_check_ins(batch)
+            except (ClientError, asyncio.TimeoutError) as e:
+                logger.warning("Не удалось передать %d отметок, повторим позже: %r", len(batch), e)
+                return False
+            async with async_session_maker() as session:
+                await db_functions.delete_check_in_reports(session, (report.id for report in reports))
+
+    async def close(self) -> None:
+        # Непереданные отметки остаются в outbox и уйдут после перезапуска
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        try:
+            await self.flush()
+        except SQLAlchemyError:
+            logger.exception("Не удалось передать отметки при остановке")
+
+
+class CheckInReconciler:
+    """Офлайн-очередь отметок по QR-коду на время недоступности Verify Service
+
+    Отметка пишется в таблицу check_in_scans вместе со временем сканирования,
+    студент сразу получает предварительный ответ. Фоновая сверка раз в interval
+    секунд берет самые старые отметки пачками по batch_size, проверяет каждый UUID
+    пачки одним запросом (со временем самого раннего сканирования) и сообщает
+    студентам итог. Пока сервис отвечает ошибками, сверка откладывается, а новые
+    отметки сразу уходят в очередь без ожидания таймаута.
+    """
+
+    def __init__(self, batch_size: int = 100, interval: float = 15.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._bot: Optional[Bot] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._unavailable_until = 0.0
+
+    def configure(self, batch_size: int, interval: float) -> None:
+        self.batch_size = batch_size
+        self.interval = interval
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._unavailable_until
+
+    def mark_unavailable(self, error: Exception) -> None:
+        if self.available:
+            logger.warning("Verify Service недоступен, отметки сохраняются в офлайн-очередь: %s", error)
+        self._unavailable_until = time.monotonic() + self.interval
+
+    def start(self, bot: Bot) -> None:
+        """Запустить сверку (при старте бота - для отметок, оставшихся с прошлого запуска)"""
+        self._bot = bot
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def enqueue(self, bot: Bot, uuid: str, tg_id: int, chat_id: int, scanned_at: float) -> None:
+        async with async_session_maker() as session:
+            await db_functions.add_check_in_scan(session, uuid=uuid, tg_id=tg_id, chat_id=chat_id,
+                                                 scanned_at=scanned_at)
+        self.start(bot)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(max(self.interval, self._unavailable_until - time.monotonic()))
+            try:
+                if await self.reconcile():
+                    return
+            except SQLAlchemyError:
+                logger.exception("Сверка офлайн-отметок не удалась, повторим позже")
+
+    async def reconcile(self) -> bool:
+        """Сверить отметки пачками; True - очередь пуста, False - сервис снова недоступен"""
+        while True:
+            async with async_session_maker() as session:
+                scans = await db_functions.get_pending_scans(session, limit=self.batch_size)
+            if not scans:
+                return True
+
+            by_uuid: Dict[str, List[CheckInScan]] = {}
+            for scan in scans:
+                by_uuid.setdefault(scan.uuid, []).append(scan)
+            results = await asyncio.gather(*(self._verify(uuid, min(scan.scanned_at for scan in uuid_scans))
+                                             for uuid, uuid_scans in by_uuid.items()))
+
+            resolved = [(scan, valid) for valid, uuid_scans in zip(results, by_uuid.values())
+                        if isinstance(valid, bool) for scan in uuid_scans]
+            errors = [error for error in results if isinstance(error, Exception)]
+            async with async_session_maker() as session:
+                await db_functions.save_scan_statuses(
+                    session, ((scan.id, (ScanStatus.CONFIRMED if valid else ScanStatus.REJECTED).value)
+                              for scan, valid in resolved))
+            await self._notify(resolved)
+
+            if len(resolved) < len(scans):
+                self.mark_unavailable(errors[0])
+                return False
+
+    @staticmethod
+    async def _verify(uuid: str, scanned_at: float) -> Union[bool, Exception]:
+        """Результат проверки UUID или ошибка недоступности сервиса (отметка остается в очереди)"""
+        try:
+            verify_result = await VerifyApiController.verify_uuid(
+                uuid, scanned_at=datetime.fromtimestamp(scanned_at, timezone.utc).isoformat())
+        except (ClientError, asyncio.TimeoutError) as e:
+            if is_service_failure(e):
+                return e
+            return False
+        return verify_result.valid
+
+    async def _notify(self, resolved: List[Tuple[CheckInScan, bool]]) -> None:
+        with bulk_sends():
+            for scan, valid in resolved:
+                text = lexicon_ru.CHECK_IN_CONFIRMED_TEXT if valid else lexicon_ru.CHECK_IN_REJECTED_TEXT
+                scanned_at = datetime.fromtimestamp(scan.scanned_at).strftime("%d.%m %H:%M")
+                try:
+                    await self._bot.send_message(chat_id=scan.chat_id, text=text.format(scanned_at=scanned_at))
+                except TelegramAPIError as e:
+                    logger.warning("Не удалось сообщить итог офлайн-отметки в чат %s: %r", scan.chat_id, e)
+
+    async def close(self) -> None:
+        # Несверенные отметки остаются в БД и будут сверены после перезапуска
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+
+async def restore_check_in_state() -> None:
+    """После перезапуска: вернуть защиту от повторных отметок и дослать непереданные отметки"""
+    async with async_session_maker() as session:
+        keys = await db_functions.load_check_in_replays(session, since=time.time() - check_in_tokens.replay_ttl)
+    check_in_tokens.remember(keys)
+    if not check_in_reporter.enabled:
+        logger.warning("CHECK_IN_REPORT_PATH не задан: отметки по токенам выключены, outbox не передается")
+    check_in_reporter.start()
+
+
+check_in_pipeline = CheckInPipeline()
+check_in_reporter = CheckInReporter()
+check_in_reconciler = CheckInReconciler()
+
+TOKEN_STATUS_TEXTS = {
+    TokenStatus.OK: lexicon_ru.SUCCESS_CHECK_IN,
+    TokenStatus.INVALID: lexicon_ru.UNSUCCESS_CHECK_IN,
+    TokenStatus.EXPIRED: lexicon_ru.CHECK_IN_EXPIRED_TEXT,
+    TokenStatus.REPLAY: lexicon_ru.CHECK_IN_REPLAY_TEXT,
+}
+
+
+async def check_in_by_deeplink(message: Message, bot: Bot, payload: str) -> None:
+    """Отметка по payload deep link: подписанный токен проверяется локально, старый UUID - через Verify API"""
+    status, token = check_in_tokens.verify(payload, tg_id=message.from_user.id)
+    if status is not None:
+        text = TOKEN_STATUS_TEXTS[status]
+        if status is TokenStatus.OK:
+            try:
+                await check_in_reporter.add(CheckInRecord(session_id=token.session_id, issuer_id=token.issuer_id,
+                                                          tgID=str(message.from_user.id),
+                                                          checked_at=datetime.now(timezone.utc).isoformat()))
+            except SQLAlchemyError:
+                logger.exception("Не удалось сохранить отметку студента %s", message.from_user.id)
+                check_in_tokens.forget(token.session_id, message.from_user.id)
+                text = lexicon_ru.CHECK_IN_ERROR_TEXT
+        await message.answer(text=text)
+        return
+
+    # Ответ сразу, проверка идет в очереди отметок и редактирует это сообщение
+    pending_message = await message.answer(text=lexicon_ru.CHECK_IN_PENDING_TEXT)
+    if not check_in_pipeline.submit(bot=bot, chat_id=pending_message.chat.id,
+                                    message_id=pending_message.message_id, uuid=payload,
+                                    tg_id=message.from_user.id, scanned_at=message.date.timestamp()):
+        await pending_message.edit_text(text=lexicon_ru.CHECK_IN_BUSY_TEXT)
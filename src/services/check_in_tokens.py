@@ -0,0 +1,220 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import secrets
+import struct
+import time
+from enum import Enum
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import BufferedInputFile, InputMediaPhoto
+from cachetools import TTLCache
+
+from src.keyboards import keyboards_ru
+from src.lexicon import lexicon_ru
+from src.services.qr_images import qr_renderer
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PREFIX = "ci"
+# session_id, issuer_id (Telegram ID администратора), номер периода ротации
+_PAYLOAD = struct.Struct(">IqI")
+_MAC_SIZE = 12
+
+
+class TokenStatus(str, Enum):
+    OK = "ok"
+    INVALID = "invalid"
+    EXPIRED = "expired"
+    REPLAY = "replay"
+
+
+class CheckInToken(NamedTuple):
+    session_id: int
+    issuer_id: int
+    period: int
+
+
+class CheckInTokens:
+    """Подписанные HMAC токены отметки, которые меняются каждые ``rotation`` секунд
+
+    Токен помещается в payload deep link (/start <токен>, до 64 символов) и
+    проверяется локально: подпись сравнивается за постоянное время, принимаются
+    токены текущего и ``grace`` предыдущих периодов. Повторная отметка студента
+    в той же сессии отклоняется по множеству (session_id, tg_id).
+    """
+
+    def __init__(self, secret: Optional[bytes] = None, rotation: float = 30, grace: int = 1,
+                 replay_ttl: float = 3 * 60 * 60, replay_size: int = 200_000):
+        self.rotation = rotation
+        self.grace = grace
+        self._secret = secret or secrets.token_bytes(32)
+        self._seen = TTLCache(maxsize=replay_size, ttl=replay_ttl)
+
+    def configure(self, secret: str, rotation: float, replay_ttl: float) -> None:
+        if secret:
+            self._secret = secret.encode()
+        else:
+            logger.warning("CHECK_IN_SECRET не задан: токены отметки станут недействительны после перезапуска")
+        self.rotation = rotation
+        self._seen = TTLCache(maxsize=self._seen.maxsize, ttl=replay_ttl)
+
+    @property
+    def replay_ttl(self) -> float:
+        return self._seen.ttl
+
+    def period(self, now: Optional[float] = None) -> int:
+        return int((time.time() if now is None else now) // self.rotation)
+
+    def issue(self, session_id: int, issuer_id: int, now: Optional[float] = None) -> str:
+        payload = _PAYLOAD.pack(session_id, issuer_id, self.period(now))
+        token = payload + self._sign(payload)
+        return TOKEN_PREFIX + base64.urlsafe_b64encode(token).rstrip(b"=").decode()
+
+    def verify(self, value: str, tg_id: int,
+               now: Optional[float] = None) -> Tuple[Optional[TokenStatus], Optional[CheckInToken]]:
+        """Проверить токен из deep link; (None, None) - это не токен (старый UUID-код)"""
+        if not value.startswith(TOKEN_PREFIX):
+            return None, None
+        encoded = value[len(TOKEN_PREFIX):]
+        try:
+            raw = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+        except (binascii.Error, ValueError):
+            return TokenStatus.INVALID, None
+        if len(raw) != _PAYLOAD.size + _MAC_SIZE:
+            return TokenStatus.INVALID, None
+
+        payload, mac = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+        if not hmac.compare_digest(mac, self._sign(payload)):
+            return TokenStatus.INVALID, None
+        token = CheckInToken(*_PAYLOAD.unpack(payload))
+
+        current = self.period(now)
+        if not current - self.grace <= token.period <= current:
+            return TokenStatus.EXPIRED, token
+
+        replay_key = (token.session_id, tg_id)
+        if replay_key in self._seen:
+            return TokenStatus.REPLAY, token
+        self._seen[replay_key] = None
+        return TokenStatus.OK, token
+
+    def remember(self, keys: Iterable[Tuple[int, int]]) -> None:
+        """Восстановить ключи (session_id, tg_id) уже принятых отметок (после перезапуска)"""
+        for key in keys:
+            self._seen[key] = None
+
+    def forget(self, session_id: int, tg_id: int) -> None:
+        """Снять отметку, которую не удалось сохранить: студент сможет отсканировать код еще раз"""
+        self._seen.pop((session_id, tg_id), None)
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._secret, payload, hashlib.sha256).digest()[:_MAC_SIZE]
+
+
+class CheckInSession:
+    __slots__ = ("session_id", "issuer_id", "chat_id", "message_id", "task")
+
+    def __init__(self, session_id: int, issuer_id: int, chat_id: int):
+        self.session_id = session_id
+        self.issuer_id = issuer_id
+        self.chat_id = chat_id
+        self.message_id: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class CheckInSessions:
+    """Экраны отметки у администраторов
+
+    Сессия отправляет фото QR-кода со ссылкой отметки и на каждой ротации токена
+    заменяет его новым (editMessageMedia). Коды следующих ``prerender`` периодов
+    рендерятся заранее в пуле процессов qr_renderer.
+    """
+
+    def __init__(self, tokens: CheckInTokens, duration: float = 2 * 60 * 60, prerender: int = 3):
+        self.tokens = tokens
+        self.duration = duration
+        self.prerender = prerender
+        self._sessions: Dict[int, CheckInSession] = {}
+
+    def open(self, bot: Bot, chat_id: int, issuer_id: int) -> int:
+        session = CheckInSession(session_id=secrets.randbits(32), issuer_id=issuer_id, chat_id=chat_id)
+        session.task = asyncio.create_task(self._rotate(bot, session))
+        self._sessions[session.session_id] = session
+        return session.session_id
+
+    def close(self, session_id: int) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.task.cancel()
+        return True
+
+    async def resend(self, bot: Bot, session_id: int) -> bool:
+        """Отправить текущий код заново (например, экран чата ушел вверх); старое фото удаляется"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return False
+        old_message_id = session.message_id
+        await self._show(bot, session, edit=False)
+        if old_message_id is not None:
+            try:
+                await bot.delete_message(chat_id=session.chat_id, message_id=old_message_id)
+            except TelegramAPIError:
+                pass
+        return True
+
+    async def link(self, bot: Bot, session: CheckInSession, now: Optional[float] = None) -> str:
+        me = await bot.me()
+        return f"https://t.me/{me.username}?start={self.tokens.issue(session.session_id, session.issuer_id, now)}"
+
+    async def _show(self, bot: Bot, session: CheckInSession, edit: bool) -> None:
+        now = time.time()
+        link = await self.link(bot, session, now)
+        file_id = qr_renderer.get_file_id(link)
+        photo = file_id or BufferedInputFile(await qr_renderer.render(link), filename="check-in.png")
+        caption = lexicon_ru.CHECK_IN_SESSION_TEXT.format(link=link, rotation=round(self.tokens.rotation))
+        keyboard = keyboards_ru.gen_check_in_session_keyboard(session_id=session.session_id)
+
+        if edit and session.message_id is not None:
+            message = await bot.edit_message_media(media=InputMediaPhoto(media=photo, caption=caption),
+                                                   chat_id=session.chat_id, message_id=session.message_id,
+                                                   reply_markup=keyboard)
+        else:
+            message = await bot.send_photo(chat_id=session.chat_id, photo=photo, caption=caption,
+                                           reply_markup=keyboard)
+        session.message_id = message.message_id
+        if file_id is None and message.photo:
+            qr_renderer.set_file_id(link, message.photo[-1].file_id)
+
+        qr_renderer.prerender([await self.link(bot, session, now + step * self.tokens.rotation)
+                               for step in range(1, self.prerender + 1)])
+
+    async def _rotate(self, bot: Bot, session: CheckInSession) -> None:
+        deadline = time.monotonic() + self.duration
+        try:
+            await self._show(bot, session, edit=False)
+            while True:
+                # Просыпаемся на границе следующего периода, чтобы код менялся вместе с токеном
+                await asyncio.sleep(self.tokens.rotation - time.time() % self.tokens.rotation)
+                if time.monotonic() >= deadline:
+                    break
+                await self._show(bot, session, edit=True)
+            await bot.delete_message(chat_id=session.chat_id, message_id=session.message_id)
+            await bot.send_message(chat_id=session.chat_id, text=lexicon_ru.CHECK_IN_SESSION_CLOSED_TEXT,
+                                   reply_markup=keyboards_ru.menu_keyboard)
+        except TelegramAPIError as e:
+            # Сообщение удалено или недоступно: сессию больше некому показывать
+            logger.warning("Экран отметки %s остановлен: %r", session.session_id, e)
+        finally:
+            if self._sessions.get(session.session_id) is session:
+                del self._sessions[session.session_id]
+
+
+check_in_tokens = CheckInTokens()
+check_in_sessions = CheckInSessions(check_in_tokens)
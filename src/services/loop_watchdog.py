@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from src.services.metrics import loop_lag
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = str(Path(__file__).resolve().parents[2])
+
+
+@dataclass
+class Stall:
+    started_at: float
+    duration: float
+    site: str
+    stack: List[str]
+
+
+@dataclass
+class StallSite:
+    site: str
+    count: int
+    total: float
+    worst: float
+    stack: List[str]
+
+
+def _blocking_site(stack: traceback.StackSummary) -> str:
+    """Самый глубокий кадр кода проекта: именно он вызвал блокирующую функцию"""
+    for frame in reversed(stack):
+        if frame.filename.startswith(PROJECT_ROOT) and "site-packages" not in frame.filename:
+            return f"{Path(frame.filename).relative_to(PROJECT_ROOT)}:{frame.lineno} in {frame.name}"
+    if stack:
+        return f"{stack[-1].filename}:{stack[-1].lineno} in {stack[-1].name}"
+    return "unknown"
+
+
+class LoopWatchdog:
+    """Сторож задержек event loop
+
+    Корутина-пульс просыпается каждые ``interval`` секунд и пишет запоздание в метрику.
+    Фоновый поток проверяет пульс; если loop не отвечает дольше ``threshold``, поток
+    снимает стек потока loop через sys._current_frames() - это и есть блокирующий код.
+    Последние ``history`` зависаний хранятся в кольцевом буфере, по местам вызова
+    копится сводка для команды администратора.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, history: int = 100):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: Deque[Stall] = deque(maxlen=history)
+        self._sites: Dict[str, StallSite] = {}
+        self._beat = 0.0
+        self._capture: Optional[Tuple[float, traceback.StackSummary]] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def configure(self, threshold: float, interval: float, history: int) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = deque(self.stalls, maxlen=history)
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self._beat - self.interval)
+            loop_lag.observe((), lag)
+            if lag >= self.threshold:
+                self._record(self._beat, lag)
+
+    def _watch(self) -> None:
+        # Поток не трогает объекты loop, только читает время пульса и стек
+        while not self._stopped.wait(self.interval / 2):
+            beat = self._beat
+            if time.monotonic() - beat - self.interval < self.threshold:
+                continue
+            if self._capture is not None and self._capture[0] == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._capture = (beat, traceback.extract_stack(frame))
+
+    def _record(self, beat: float, lag: float) -> None:
+        capture, self._capture = self._capture, None
+        stack = capture[1] if capture is not None and capture[0] == beat else traceback.StackSummary()
+        site = _blocking_site(stack) if stack else "unknown"
+        lines = [line.rstrip() for line in stack.format()]
+
+        self.stalls.append(Stall(started_at=time.time() - lag, duration=lag, site=site, stack=lines))
+        summary = self._sites.get(site)
+        if summary is None:
+            self._sites[site] = StallSite(site=site, count=1, total=lag, worst=lag, stack=lines)
+        else:
+            summary.count += 1
+            summary.total += lag
+            if lag > summary.worst:
+                summary.worst, summary.stack = lag, lines
+        logger.warning("Event loop заблокирован на %.0f мс: %s\n%s", lag * 1000, site, "\n".join(lines))
+
+    def worst_offenders(self, limit: int = 5) -> List[StallSite]:
+        return sorted(self._sites.values(), key=lambda s: s.total, reverse=True)[:limit]
+
+
+loop_watchdog = LoopWatchdog()
@@ -0,0 +1,202 @@
+import time
+from array import array
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+# Границы бакетов задержек в секундах (как в prometheus_client)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+class Counter:
+    """Счетчик с метками: значения лежат в словаре по кортежу меток"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        values = self._values
+        values[labels] = values.get(labels, 0) + amount
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    """Гистограмма с метками
+
+    Для каждого набора меток один раз выделяется array счетчиков по бакетам,
+    запись - bisect по границам и инкремент элемента массива, без новых объектов.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.bounds = tuple(sorted(buckets))
+        # Последний элемент массива - бакет +Inf, затем сумма и количество
+        self._size = len(self.bounds) + 3
+        self._series: Dict[Tuple[str, ...], array] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = array("d", bytes(8 * self._size))
+        series[bisect_left(self.bounds, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self._series.items():
+            cumulative = 0.0
+            for bound, count in zip(self.bounds + (float("inf"),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {_format_value(cumulative)}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {repr(series[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {_format_value(series[-1])}"
+
+
+class CallbackMetric:
+    """Метрика, значение которой читается в момент выдачи (размер хранилища, счетчики middleware)"""
+
+    def __init__(self, name: str, documentation: str, kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self._callback: Optional[Callable[[], float]] = None
+
+    def set_callback(self, callback: Callable[[], float]) -> None:
+        self._callback = callback
+
+    def collect(self) -> Iterable[str]:
+        if self._callback is None:
+            return
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield f"{self.name} {_format_value(float(self._callback()))}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def register(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+update_latency = registry.register(Histogram(
+    "bot_update_duration_seconds", "Время обработки апдейта по типу", ("update_type",)))
+handler_latency = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Время работы хендлера", ("handler",)))
+handler_errors = registry.register(Counter(
+    "bot_handler_errors_total", "Исключения в хендлерах", ("handler",)))
+backend_latency = registry.register(Histogram(
+    "backend_request_duration_seconds", "Время запроса к сервису по методу контроллера", ("endpoint",)))
+backend_errors = registry.register(Counter(
+    "backend_request_errors_total", "Ошибки запросов к сервисам", ("endpoint", "error")))
+throttling_dropped = registry.register(CallbackMetric(
+    "bot_throttling_dropped_total", "Апдейты, отброшенные троттлингом", kind="counter"))
+db_updates_total = registry.register(CallbackMetric(
+    "bot_db_middleware_updates_total", "Апдейты, прошедшие через DB middleware", kind="counter"))
+db_updates_with_session = registry.register(CallbackMetric(
+    "bot_db_middleware_sessions_total", "Апдейты, которым понадобилась сессия БД", kind="counter"))
+loop_lag = registry.register(Histogram(
+    "bot_event_loop_lag_seconds", "Запоздание пробуждения event loop"))
+fsm_storage_size = registry.register(CallbackMetric(
+    "bot_fsm_storage_records", "Число записей FSM в памяти хранилища"))
+check_in_queue_size = registry.register(CallbackMetric(
+    "bot_check_in_queue_size", "Отметки по QR-коду, ожидающие проверки"))
+outbound_wait = registry.register(Histogram(
+    "bot_outbound_wait_seconds", "Ожидание слота отправки в Bot API", ("traffic",)))
+outbound_waiting = registry.register(CallbackMetric(
+    "bot_outbound_waiting_requests", "Запросы к Bot API в очереди за общим слотом"))
+update_queue_depth = registry.register(CallbackMetric(
+    "bot_update_queue_depth", "Апдейты в очередях пула воркеров"))
+updates_dropped = registry.register(Counter(
+    "bot_updates_dropped_total", "Апдейты, отброшенные при переполнении очереди пула",
+    ("reason",)))
+telegram_flood_waits = registry.register(Counter(
+    "bot_telegram_flood_waits_total", "Ответы Telegram с retry_after (flood wait)", ("method",)))
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Замер времени обработки
+
+    На dp.update (outer) пишет задержку по типу апдейта, на message/callback_query
+    (inner, хендлер уже выбран) - по имени хендлера.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object: Optional[HandlerObject] = data.get('handler')
+        if handler_object is None:
+            histogram, labels = update_latency, (getattr(event, 'event_type', 'unknown'),)
+        else:
+            histogram, labels = handler_latency, (handler_object.callback.__name__,)
+
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            if handler_object is not None:
+                handler_errors.inc(labels)
+            raise
+        finally:
+            histogram.observe(labels, time.perf_counter() - start)
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Поднять локальный HTTP-эндпоинт /metrics в формате Prometheus"""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    return runner
@@ -0,0 +1,84 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterable, Optional
+
+import qrcode
+from cachetools import LRUCache, TTLCache
+
+from src.backend.coalescing_cache import CoalescingCache
+
+logger = logging.getLogger(__name__)
+
+
+def render_qr_png(data: str, box_size: int = 10, border: int = 4) -> bytes:
+    """Нарисовать QR-код в PNG (выполняется в процессе пула, не в event loop)"""
+    image = qrcode.make(data, box_size=box_size, border=border)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class QrRenderer:
+    """PNG QR-кодов ссылок отметки
+
+    Рендер идет в ProcessPoolExecutor, который создается в start() при запуске бота.
+    Процессы пула стартуют через spawn: fork процесса с работающим event loop,
+    сессиями aiohttp и потоками aiosqlite копирует их состояние в дочерний процесс.
+    Готовые PNG кэшируются по ссылке, одновременные запросы одной ссылки объединяются. После первой загрузки в Telegram запоминается
+    file_id, и повторные отправки того же кода не загружают файл заново.
+    """
+
+    def __init__(self, workers: int = 2, cache_size: int = 256, cache_ttl: float = 15 * 60):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._images = CoalescingCache(maxsize=cache_size, ttl=cache_ttl)
+        self._file_ids = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._prerender_tasks = LRUCache(maxsize=cache_size)
+
+    def configure(self, workers: int) -> None:
+        self.workers = workers
+
+    async def render(self, data: str) -> bytes:
+        return await self._images.get_or_fetch(data, partial(self._render, data))
+
+    def start(self) -> None:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+
+    async def _render(self, data: str) -> bytes:
+        if self._pool is None:
+            raise RuntimeError("QrRenderer: пул не создан, вызовите start()")
+        return await asyncio.get_running_loop().run_in_executor(self._pool, render_qr_png, data)
+
+    def prerender(self, items: Iterable[str]) -> None:
+        """Заранее отрендерить коды следующих периодов в фоне"""
+        for data in items:
+            if data in self._file_ids or data in self._prerender_tasks:
+                continue
+            task = asyncio.create_task(self.render(data))
+            task.add_done_callback(self._on_prerendered)
+            self._prerender_tasks[data] = task
+
+    @staticmethod
+    def _on_prerendered(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Не удалось отрендерить QR-код: %r", task.exception())
+
+    def get_file_id(self, data: str) -> Optional[str]:
+        return self._file_ids.get(data)
+
+    def set_file_id(self, data: str, file_id: str) -> None:
+        self._file_ids[data] = file_id
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+qr_renderer = QrRenderer()
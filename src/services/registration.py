@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import Iterable, Optional, Set, Tuple
+
+from src.backend.users_controller import BackendUsersController
+from src.database import db_functions
+from src.database.database import async_session_maker
+
+logger = logging.getLogger(__name__)
+
+
+class UserRegistrar:
+    """Регистрация пользователей в Users Service без ожидания на /start
+
+    Множество известных пользователей загружается из локального зеркала (таблица users),
+    поэтому повторный /start не делает сетевых запросов. Новые пользователи ставятся
+    в очередь и регистрируются фоновой задачей пачками по batch_size. При ошибке
+    пользователь убирается из известных, и регистрация повторится на следующем /start.
+    """
+
+    def __init__(self, batch_size: int = 20, batch_interval: float = 0.5):
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.known: Set[int] = set()
+        self._queue: "asyncio.Queue[Tuple[int, str]]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def load_known(self) -> None:
+        """Добавить в известные всех пользователей из локального зеркала"""
+        async with async_session_maker() as session:
+            self.remember(await db_functions.get_user_ids(session))
+
+    def remember(self, user_ids: Iterable[int]) -> None:
+        self.known.update(user_ids)
+
+    def register(self, tg_id: int, language: str) -> bool:
+        """Поставить пользователя в очередь на регистрацию, если он еще не известен"""
+        if tg_id in self.known:
+            return False
+        self.known.add(tg_id)
+        self._queue.put_nowait((tg_id, language))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            results = await asyncio.gather(
+                *(BackendUsersController.create_user(tgID=str(tg_id), language=language)
+                  for tg_id, language in batch),
+                return_exceptions=True
+            )
+            for (tg_id, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    self.known.discard(tg_id)
+                    logger.warning("Не удалось зарегистрировать пользователя %s: %r", tg_id, result)
+            await asyncio.sleep(self.batch_interval)
+
+
+user_registrar = UserRegistrar()
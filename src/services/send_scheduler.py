@@ -0,0 +1,227 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from cachetools import LRUCache
+
+from src.services.metrics import outbound_wait, telegram_flood_waits
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+
+# Массовые отправки (рассылки, пересылка репортов в группу администраторов) помечаются
+# в своем контексте и пропускают вперед ответы пользователям
+bulk_traffic: ContextVar[bool] = ContextVar("bulk_traffic", default=False)
+
+
+@contextmanager
+def bulk_sends() -> Iterator[None]:
+    """Отправки внутри блока идут с низким приоритетом"""
+    token = bulk_traffic.set(True)
+    try:
+        yield
+    finally:
+        bulk_traffic.reset(token)
+
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не больше capacity подряд"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд появится токен"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now: float) -> float:
+        """Занять токен (в долг, если их нет) и вернуть, сколько ждать до отправки"""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, now: float, seconds: float) -> None:
+        """Не выдавать токены seconds секунд (flood wait)"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов к Bot API (middleware сессии бота)
+
+    Запросы с chat_id проходят два лимита: токен-бакет чата (личный чат около
+    сообщения в секунду, группа около 20 в минуту) и общий бакет бота (около 30 в
+    секунду). За общий слот запросы стоят в очереди с приоритетом: ответы
+    пользователям идут раньше массовых отправок (bulk_sends). На TelegramRetryAfter
+    чат ставится на паузу, массовые отправки приостанавливаются целиком, а запрос
+    повторяется после паузы. Бакеты чатов массовых отправок лежат в отдельном кэше:
+    рассылка по тысячам чатов не вытесняет бакеты чатов, с которыми идет диалог. Хендлеры ничего об этом не знают: работает для
+    message.answer, edit_text, send_copy и прямых вызовов bot.*.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        group_rate: float = 20 / 60,
+        burst: float = 3,
+        max_retries: int = 3,
+        max_flood_wait: float = 60,
+        chats: int = 10_000
+    ):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_flood_wait = max_flood_wait
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        self._chats: LRUCache = LRUCache(maxsize=chats)
+        self._bulk_chats: LRUCache = LRUCache(maxsize=chats)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump: Optional[asyncio.Task] = None
+        self._bulk_paused_until = 0.0
+
+    def configure(self, global_rate: float, chat_rate: float, group_rate: float, burst: float,
+                  max_retries: int, max_flood_wait: float) -> None:
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_flood_wait = max_flood_wait
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        self._chats.clear()
+        self._bulk_chats.clear()
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = self._chat_key(getattr(method, "chat_id", None))
+        priority = BULK if bulk_traffic.get() else INTERACTIVE
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                await self._acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                telegram_flood_waits.inc((method.__api_method__,))
+                self._park(chat_id, priority, e.retry_after)
+                attempt += 1
+                if attempt > self.max_retries or e.retry_after > self.max_flood_wait:
+                    raise
+                logger.warning("Flood wait %s с на %s (чат %s), повтор", e.retry_after, method.__api_method__,
+                               chat_id)
+                if chat_id is None:
+                    await asyncio.sleep(e.retry_after)
+
+    async def _acquire(self, chat_id: Union[int, str], priority: int) -> None:
+        start = time.monotonic()
+        delay = self._chat_bucket(chat_id, priority, start).reserve(start)
+        if delay:
+            await asyncio.sleep(delay)
+        await self._global_slot(priority)
+        outbound_wait.observe(("bulk" if priority == BULK else "interactive",), time.monotonic() - start)
+
+    @staticmethod
+    def _chat_key(chat_id: Optional[Union[int, str]]) -> Optional[Union[int, str]]:
+        # Получатели рассылок хранят chat_id строкой (MailingRecipient.chat_id)
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            return int(chat_id)
+        return chat_id
+
+    def _chat_bucket(self, chat_id: Union[int, str], priority: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            return bucket
+        # Массовая отправка в чат с активным диалогом делит с ним бакет, остальные идут в свой кэш;
+        # при ответе пользователю бакет переносится из кэша массовых отправок вместе с остатком токенов
+        bucket = self._bulk_chats.pop(chat_id, None) if priority == INTERACTIVE else self._bulk_chats.get(chat_id)
+        if bucket is None:
+            # Отрицательный chat_id и @username - группы и каналы, у них лимит строже
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            bucket = TokenBucket(self.chat_rate if is_private else self.group_rate, self.burst, now)
+        if priority == INTERACTIVE:
+            self._chats[chat_id] = bucket
+        else:
+            self._bulk_chats[chat_id] = bucket
+        return bucket
+
+    async def _global_slot(self, priority: int) -> None:
+        now = time.monotonic()
+        if not self._waiters and self._ready_in(priority, now) == 0:
+            self._global.reserve(now)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._wakeup.set()
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await future
+
+    def _ready_in(self, priority: int, now: float) -> float:
+        delay = self._global.delay(now)
+        if priority == BULK:
+            delay = max(delay, self._bulk_paused_until - now)
+        return delay
+
+    async def _run_pump(self) -> None:
+        """Выдавать общие слоты по одному в порядке приоритета"""
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            now = time.monotonic()
+            delay = self._ready_in(priority, now)
+            if delay > 0:
+                # Новый запрос с более высоким приоритетом будит насос раньше
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._waiters)
+            self._global.reserve(now)
+            future.set_result(None)
+
+    def _park(self, chat_id: Optional[Union[int, str]], priority: int, seconds: float) -> None:
+        now = time.monotonic()
+        if chat_id is not None:
+            self._chat_bucket(chat_id, priority, now).pause(now, seconds)
+        self._bulk_paused_until = max(self._bulk_paused_until, now + seconds)
+
+
+send_scheduler = SendScheduler()
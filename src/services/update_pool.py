@@ -0,0 +1,176 @@
+import asyncio
+import logging
+from enum import Enum
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from aiogram import BaseMiddleware, Router
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.dispatcher.middlewares.error import ErrorsMiddleware
+from aiogram.types import TelegramObject, Update
+
+from src.services.metrics import updates_dropped
+
+logger = logging.getLogger(__name__)
+
+
+class OverloadPolicy(str, Enum):
+    # Ждать места в общей очереди: polling перестает забирать новые апдейты (backpressure)
+    BLOCK = "block"
+    # Отбросить новый апдейт
+    DROP = "drop"
+    # Вытеснить самый старый апдейт самой длинной очереди: свежие нажатия важнее
+    SHED = "shed"
+
+
+class UpdateJob(NamedTuple):
+    handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+    event: Update
+    data: Dict[str, Any]
+
+
+class UpdateWorkerPool(BaseMiddleware):
+    """Обработка апдейтов фиксированным пулом воркеров (outer middleware на dp.update)
+
+    Апдейт кладется в очередь одного из workers воркеров по хешу ID пользователя
+    (без пользователя - чата), поэтому апдейты одного пользователя выполняются
+    строго по очереди и не гоняются за одни и те же данные FSM, а разные
+    пользователи обрабатываются параллельно. Общее число ожидающих апдейтов
+    ограничено queue_size, при переполнении действует policy. Очередь одного
+    воркера отдельно ограничена shard_size и никогда не блокирует прием: лишние
+    апдейты одного пользователя отбрасываются (при shed - вытесняются старые),
+    чтобы он не остановил polling для всех. Вызывающий, которому нужен
+    результат обработки, передает в feed_update future update_processed.
+
+    Middleware диспетчера, стоящие до пула, отработали еще при постановке в
+    очередь. Поэтому воркер перечитывает состояние FSM (его мог сменить предыдущий
+    апдейт пользователя) и сам передает ошибки хендлеров в router.errors
+    диспетчера: ErrorsMiddleware диспетчера к этому моменту уже вернул управление.
+    """
+
+    def __init__(self, workers: int = 256, queue_size: int = 4096, shard_size: int = 64,
+                 policy: OverloadPolicy = OverloadPolicy.BLOCK):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.shard_size = shard_size
+        self.policy = policy
+        self._queues: List["asyncio.Queue[UpdateJob]"] = []
+        self._tasks: List[asyncio.Task] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._errors: Optional[ErrorsMiddleware] = None
+
+    def configure(self, workers: int, queue_size: int, shard_size: int, policy: str,
+                  router: Optional[Router] = None) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self.shard_size = shard_size
+        self.policy = OverloadPolicy(policy)
+        self._errors = ErrorsMiddleware(router) if router is not None else None
+
+    def __len__(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not self._queues:
+            self._start()
+        queue = self._queues[self._shard(event, data)]
+        job = UpdateJob(handler=handler, event=event, data=data)
+
+        if self._slots.locked():
+            if self.policy is OverloadPolicy.DROP:
+                updates_dropped.inc((self.policy.value,))
+                return self._reject(job)
+            if self.policy is OverloadPolicy.SHED:
+                updates_dropped.inc((self.policy.value,))
+                self._evict(max(self._queues, key=lambda shard: shard.qsize()))
+        await self._slots.acquire()
+        if queue.full():
+            # Очередь одного пользователя переполнена: ждать ее нельзя, это остановило бы прием для всех
+            updates_dropped.inc(("shard",))
+            if self.policy is not OverloadPolicy.SHED:
+                self._slots.release()
+                return self._reject(job)
+            self._evict(queue)
+        queue.put_nowait(job)
+        return None
+
+    def _reject(self, job: UpdateJob) -> Any:
+        self._finish(job, UNHANDLED)
+        return UNHANDLED
+
+    def _evict(self, queue: "asyncio.Queue[UpdateJob]") -> None:
+        self._reject(queue.get_nowait())
+        queue.task_done()
+        self._slots.release()
+
+    def _shard(self, event: Update, data: Dict[str, Any]) -> int:
+        # event_from_user и event_chat уже заполнил UserContextMiddleware диспетчера
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        key = user.id if user is not None else chat.id if chat is not None else event.update_id
+        return key % len(self._queues)
+
+    def _start(self) -> None:
+        self._slots = asyncio.Semaphore(self.queue_size)
+        self._queues = [asyncio.Queue(maxsize=self.shard_size) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._run(queue)) for queue in self._queues]
+
+    async def _run(self, queue: "asyncio.Queue[UpdateJob]") -> None:
+        while True:
+            job = await queue.get()
+            self._slots.release()
+            try:
+                handler = partial(self._process, job.handler)
+                if self._errors is not None:
+                    result = await self._errors(handler, job.event, job.data)
+                else:
+                    result = await handler(job.event, job.data)
+            except Exception as e:
+                logger.exception("Ошибка при обработке апдейта %s", job.event.update_id)
+                self._finish(job, error=e)
+            else:
+                self._finish(job, result)
+            finally:
+                queue.task_done()
+
+    @staticmethod
+    async def _process(
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        # raw_state прочитан FSMContextMiddleware при постановке в очередь, а апдейты
+        # пользователя, стоявшие в очереди раньше, могли его сменить
+        state = data.get("state")
+        if state is not None:
+            data["raw_state"] = await state.get_state()
+        return await handler(event, data)
+
+    @staticmethod
+    def _finish(job: UpdateJob, result: Any = None, error: Optional[BaseException] = None) -> None:
+        future: Optional[asyncio.Future] = job.data.get("update_processed")
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def join(self, timeout: Optional[float] = None) -> None:
+        """Дождаться обработки принятых апдейтов (при остановке бота)"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Остановка: в очередях апдейтов осталось %d", len(self))
+        for task in self._tasks:
+            task.cancel()
+        self._queues = []
+        self._tasks = []
+
+
+update_pool = UpdateWorkerPool()
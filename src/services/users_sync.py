@@ -0,0 +1,19 @@
+import asyncio
+import logging
+
+from src.backend.users_controller import BackendUsersController
+from src.services.registration import user_registrar
+
+logger = logging.getLogger(__name__)
+
+
+async def run_users_sync(interval: float) -> None:
+    """Периодически синхронизировать локальное зеркало пользователей с Users Service"""
+    while True:
+        try:
+            count = await BackendUsersController.sync_users_mirror()
+            await user_registrar.load_known()
+            logger.info("Зеркало пользователей синхронизировано: %d", count)
+        except Exception:
+            logger.exception("Не удалось синхронизировать зеркало пользователей")
+        await asyncio.sleep(interval)
@@ -0,0 +1,62 @@
+import asyncio
+import secrets
+import signal
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import Webhook
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """Обработчик вебхука, который при остановке дожидается уже принятых апдейтов
+
+    Telegram сразу получает 200, апдейт обрабатывается в фоне (handle_in_background).
+    drain() ждет фоновые задачи приема и должен выполниться до shutdown диспетчера;
+    сессия бота закрывается (close) последней.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, drain_timeout: float = 10, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.drain_timeout = drain_timeout
+
+    async def drain(self, *args: Any, **kwargs: Any) -> None:
+        if self._background_feed_update_tasks:
+            await asyncio.wait(set(self._background_feed_update_tasks), timeout=self.drain_timeout)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, config: Webhook) -> None:
+    """Принимать апдейты через aiohttp-сервер до SIGINT/SIGTERM"""
+    # Без заданного секрета генерируем случайный: проверка заголовка Telegram включена всегда
+    secret_token = config.secret or secrets.token_urlsafe(32)
+
+    app = web.Application()
+    handler = DrainingRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token,
+                                     drain_timeout=config.drain_timeout)
+    # Порядок on_shutdown: прием апдейтов -> shutdown диспетчера -> сессия бота
+    app.on_shutdown.append(handler.drain)
+    setup_application(app, dp, bot=bot)
+    handler.register(app, path=config.path)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=config.host, port=config.port).start()
+    await bot.set_webhook(url=f"{config.base_url.rstrip('/')}{config.path}", secret_token=secret_token,
+                          allowed_updates=dp.resolve_used_update_types())
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка по KeyboardInterrupt
+            pass
+
+    try:
+        await stop_event.wait()
+    finally:
+        # on_shutdown: дожидаемся принятых апдейтов, затем закрываем хранилище и сессию бота
+        await runner.cleanup()
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, Chat, ErrorEvent, Message, Update, User
+
+from src.services.update_pool import UpdateWorkerPool
+
+USER = User(id=7, is_bot=False, first_name="Admin")
+CHAT = Chat(id=7, type="private")
+
+
+class MailingStates(StatesGroup):
+    wait_message = State()
+
+
+def message_update(update_id: int, text: str) -> Update:
+    return Update(update_id=update_id,
+                  message=Message(message_id=update_id, date=datetime.now(), chat=CHAT, from_user=USER, text=text))
+
+
+def callback_update(update_id: int, data: str) -> Update:
+    message = Message(message_id=update_id, date=datetime.now(), chat=CHAT, from_user=USER, text="menu")
+    return Update(update_id=update_id,
+                  callback_query=CallbackQuery(id=str(update_id), from_user=USER, chat_instance="test",
+                                               message=message, data=data))
+
+
+def build(router: Router) -> tuple[Dispatcher, UpdateWorkerPool]:
+    dp = Dispatcher(storage=MemoryStorage())
+    pool = UpdateWorkerPool()
+    pool.configure(workers=4, queue_size=16, shard_size=8, policy="block", router=dp)
+    dp.update.outer_middleware(pool)
+    dp.include_router(router)
+    return dp, pool
+
+
+def test_queued_update_sees_state_set_by_previous_update():
+    """Кнопка рассылки и сразу за ней текст: текст должен попасть в хендлер состояния"""
+    handled = []
+    router = Router()
+
+    @router.callback_query(F.data == "mailing")
+    async def start_mailing(callback: CallbackQuery, state: FSMContext):
+        await asyncio.sleep(0.05)
+        await state.set_state(MailingStates.wait_message)
+
+    @router.message(StateFilter(MailingStates.wait_message))
+    async def mailing_message(message: Message, state: FSMContext):
+        handled.append("mailing")
+        await state.clear()
+
+    @router.message()
+    async def fallback(message: Message):
+        handled.append("fallback")
+
+    async def scenario():
+        dp, pool = build(router)
+        bot = Bot(token="42:TEST")
+        try:
+            # Как polling с handle_as_tasks=False: feed_update возвращается, как только апдейт в очереди
+            await dp.feed_update(bot, callback_update(1, "mailing"))
+            await dp.feed_update(bot, message_update(2, "Текст рассылки"))
+            await pool.join(timeout=5)
+        finally:
+            await bot.session.close()
+
+    asyncio.run(scenario())
+    assert handled == ["mailing"]
+
+
+def test_handler_error_reaches_router_errors():
+    errors = []
+    router = Router()
+
+    @router.message()
+    async def broken(message: Message):
+        raise ValueError("boom")
+
+    @router.errors()
+    async def on_error(event: ErrorEvent):
+        errors.append(event.exception)
+        return True
+
+    async def scenario():
+        dp, pool = build(router)
+        bot = Bot(token="42:TEST")
+        try:
+            await dp.feed_update(bot, message_update(1, "hi"))
+            await pool.join(timeout=5)
+        finally:
+            await bot.session.close()
+
+    asyncio.run(scenario())
+    assert len(errors) == 1 and isinstance(errors[0], ValueError)